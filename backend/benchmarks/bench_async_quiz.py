@@ -0,0 +1,181 @@
+'''
+Benchmark of concurrent quiz players against the WSGI and the ASGI entry points
+
+    python benchmarks/bench_async_quiz.py --database-url {database_url} --players 200
+
+Starts the Flask application on a WSGI server with a fixed pool of worker threads, like a
+gunicorn gthread worker, and the ASGI application of flaskr.asgi on uvicorn, each in a process
+of its own. Then every simulated player plays a game of --rounds questions on both, sending
+its previous questions with every request, and the latency and throughput are compared.
+
+The gains depend on the time the quiz requests wait on the database, so compare them on
+PostgreSQL over a network rather than on a local SQLite file.
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from suite import seed
+
+
+def serve_wsgi(database_url, port, threads):
+    from werkzeug.serving import BaseWSGIServer
+    from flaskr import create_app
+
+    class PooledWSGIServer(BaseWSGIServer):
+        # at most threads requests are handled at once, the others wait in the accept queue
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer.request_queue_size = 1024
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = PooledWSGIServer('127.0.0.1', port, create_app({'DATABASE_URL': database_url}))
+    server.serve_forever()
+
+
+def serve_asgi(database_url, port, threads):
+    import uvicorn
+    from flaskr.asgi import create_asgi_app
+
+    app = create_asgi_app({'DATABASE_URL': database_url, 'ASGI_THREADS': threads})
+    uvicorn.run(app, host='127.0.0.1', port=port, log_level='error', lifespan='on', backlog=1024)
+
+
+def get_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
+
+def start_server(mode, database_url, threads):
+    port = get_free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__),
+        '--serve', mode, '--database-url', database_url, '--port', str(port), '--threads', str(threads)
+    ])
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def post_json(port, path, body):
+    payload = json.dumps(body).encode('utf-8')
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(
+        f'POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+        f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('ascii') + payload
+    )
+    response = await reader.read()
+    writer.close()
+
+    head, _, response_body = response.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    if status != 200:
+        raise RuntimeError(f'{path}: {status}')
+    return json.loads(response_body)
+
+
+async def play(port, category_id, rounds, timings):
+    previous_questions = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        data = await post_json(port, '/api/v1/quizzes', {
+            'previous_questions': previous_questions,
+            'quiz_category': {'id': category_id} if category_id is not None else None
+        })
+        timings.append(time.perf_counter() - started_at)
+
+        if data['question'] is None:
+            return
+        previous_questions.append(data['question']['id'])
+
+
+async def run_players(port, players, rounds, category_ids):
+    timings = []
+    started_at = time.perf_counter()
+    await asyncio.gather(*[
+        play(port, category_ids[player % len(category_ids)] if player % 2 else None, rounds, timings)
+        for player in range(players)
+    ])
+    elapsed = time.perf_counter() - started_at
+
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'rps': len(timings) / elapsed,
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent quiz players against the WSGI and ASGI entry points')
+    parser.add_argument('--database-url', default='sqlite:////tmp/trivia_bench_{rows}.db')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--players', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=8, help='worker threads of the WSGI server and of the ASGI fallback pool')
+    parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    database_url = args.database_url.format(rows=args.rows)
+
+    if args.serve == 'wsgi':
+        return serve_wsgi(database_url, args.port, args.threads)
+    if args.serve == 'asgi':
+        return serve_asgi(database_url, args.port, args.threads)
+
+    from flaskr import create_app
+
+    app = create_app({'DATABASE_URL': database_url})
+    with app.app_context():
+        category_ids = seed(args.rows)
+
+    print(f'{args.players} players, {args.rounds} rounds each, {args.rows} questions in {database_url}, {args.threads} threads')
+    print(f'{"server":<8}{"requests":>10}{"rps":>10}{"p50 ms":>10}{"p99 ms":>10}')
+
+    for mode in ('wsgi', 'asgi'):
+        process, port = start_server(mode, database_url, args.threads)
+        try:
+            # warm up the question index and the connection pool
+            asyncio.run(run_players(port, args.threads, 1, category_ids))
+            result = asyncio.run(run_players(port, args.players, args.rounds, category_ids))
+        finally:
+            process.terminate()
+            process.wait()
+
+        print(f'{mode:<8}{result["requests"]:>10}{result["rps"]:>10.1f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+'''
+Benchmark of the weighted quiz question selection
+
+    python benchmarks/bench_quiz_selection.py --sizes 1000,100000,1000000
+
+Loads synthetic (id, category, difficulty) rows into a QuestionIndex for every size and
+times weighted draws from its per-(category, difficulty) buckets against filtering the
+rows in Python and drawing with random.choices, for a player who already answered
+--previous questions, and batches of --count distinct questions for a prefetched round.
+The draws from the buckets should take the same time for every size.
+'''
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flaskr.quiz import DIFFICULTIES, QuestionIndex, draw_questions, get_adaptive_weights
+
+CATEGORIES = 6
+
+
+def make_rows(size):
+    generator = random.Random(size)
+    return [(question_id, generator.randint(1, CATEGORIES), generator.choice(DIFFICULTIES)) for question_id in range(1, size + 1)]
+
+
+def filter_rows(rows, weights, category, exclude):
+    candidates = [row for row in rows if row[1] == category and row[0] not in exclude and weights.get(row[2], 0) > 0]
+    if len(candidates) == 0:
+        return None
+    return random.choices(candidates, [weights[row[2]] for row in candidates])[0][0]
+
+
+def measure(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started_at) * 1000000)
+
+    timings.sort()
+    return statistics.mean(timings), timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the weighted quiz question selection')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--previous', type=int, default=20, help='questions the player already answered')
+    parser.add_argument('--count', type=int, default=20, help='questions of a prefetched round')
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    weights = get_adaptive_weights(7, 10)
+    print(f'{"questions":>10}  {"selection":<24}{"mean us":>10}{"p50 us":>10}{"p99 us":>10}')
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        rows = make_rows(size)
+        index = QuestionIndex(ttl=None)
+        index.load(rows)
+        exclude = set(random.Random(0).sample(range(1, size + 1), min(args.previous, size)))
+
+        runs = [
+            ('buckets (weighted)', lambda: index.sample_weighted(weights, 1, exclude), args.repeat),
+            ('buckets (uniform)', lambda: index.sample(1, exclude), args.repeat),
+            (f'buckets (batch of {args.count})', lambda: draw_questions(index, args.count, 1, set(exclude), weights), args.repeat),
+            # filtering gets slow on large tables, so it is repeated less often
+            ('filter rows in python', lambda: filter_rows(rows, weights, 1, exclude), max(3, args.repeat * 1000 // size))
+        ]
+        for name, run, repeat in runs:
+            mean, p50, p99 = measure(run, repeat)
+            print(f'{size:>10}  {name:<24}{mean:>10.1f}{p50:>10.1f}{p99:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+'''
+Benchmark of create_question under burst load, with a commit per request against group commits
+
+    python benchmarks/bench_write_batching.py --database-url sqlite:////tmp/trivia_writes.db --concurrency 32
+
+Starts the Flask application on a threaded WSGI server, once committing every question on
+its own and once with WRITE_BATCHING, and sends --requests create_question requests from
+--concurrency client threads to each. Reports the requests per second, the p50/p99 latency,
+the average number of operations per group commit and the failed requests. Every run inserts
+questions into the database, so use a scratch database.
+
+The gains depend on the cost of a commit, so compare them on the database and the disks
+of the deployment: the fsync of a commit is much cheaper on a laptop SSD than on a network volume.
+'''
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from models import create_schema, db, Category
+from suite import summarize
+
+
+def send_creates(port, requests, concurrency, category_id):
+    timings = []
+    errors = []
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+
+    def worker(thread_number):
+        thread_timings = []
+        thread_errors = 0
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        for number in range(per_thread):
+            payload = json.dumps({
+                'question': f'Which burst question {thread_number}-{number}?',
+                'answer': 'This one',
+                'category': category_id,
+                'difficulty': 1 + number % 5
+            })
+            request_started_at = time.perf_counter()
+            connection.request('POST', '/api/v1/questions', body=payload, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            thread_timings.append(time.perf_counter() - request_started_at)
+            # sqlite answers concurrent commits with 'database is locked' once its busy timeout expires
+            if response.status != 200:
+                thread_errors += 1
+        connection.close()
+        with lock:
+            timings.extend(thread_timings)
+            errors.append(thread_errors)
+
+    threads = [threading.Thread(target=worker, args=(thread_number,)) for thread_number in range(concurrency)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = summarize(timings, time.perf_counter() - started_at, 0)
+    result['errors'] = sum(errors)
+    return result
+
+
+def run(args, write_batching):
+    app = create_app({
+        'DATABASE_URL': args.database_url,
+        'WRITE_BATCHING': write_batching,
+        'WRITE_BATCH_SIZE': args.batch_size,
+        'WRITE_BATCH_LATENCY': args.batch_latency
+    })
+    with app.app_context():
+        create_schema()
+        if Category.query.count() == 0:
+            db.session.add(Category('Science'))
+            db.session.commit()
+        category_id = Category.query.first().id
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        result = send_creates(server.server_port, args.requests, args.concurrency, category_id)
+    finally:
+        server.shutdown()
+
+    group_committer = app.extensions['group_commit']
+    if group_committer is not None and group_committer.batches > 0:
+        result['operations_per_commit'] = group_committer.operations / group_committer.batches
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark create_question with and without group commits')
+    parser.add_argument('--database-url', default='sqlite:////tmp/trivia_bench_writes.db')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32, help='client threads')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--batch-latency', type=float, default=0.005, help='seconds')
+    args = parser.parse_args()
+
+    # one access log line per request would dominate the measurements
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    print(f'{"mode":<24}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"ops/commit":>12}{"errors":>8}')
+    for name, write_batching in [('commit per request', False), ('group commit', True)]:
+        result = run(args, write_batching)
+        print(f'{name:<24}{result["rps"]:>10.0f}{result["p50_ms"]:>10.1f}{result["p99_ms"]:>10.1f}{result.get("operations_per_commit", 1):>12.1f}{result["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+'''
+Load-testing and benchmark suite of the read endpoints
+
+    python benchmarks/suite.py --datasets 1k,100k --save-baseline benchmarks/baseline.json
+    python benchmarks/suite.py --datasets 1k,100k --compare benchmarks/baseline.json
+
+Seeds synthetic categories and questions into one database per dataset size, then drives
+get_questions, search_questions, get_category_questions and play_quiz through the Flask
+test client and through a threaded WSGI server. Reports p50/p99 latency, requests per second
+and the peak memory allocated per request (through the test client only), and compares them
+against a stored baseline.
+
+--database-url may contain {rows}, it defaults to one SQLite file per dataset. Use scratch
+databases, the seeded questions are not removed.
+'''
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from flaskr.pagination import encode_cursor
+from models import create_schema, db, reconcile_question_counts, record_new_questions, Category, Question
+
+DATASETS = {'1k': 1000, '100k': 100000, '1m': 1000000}
+CATEGORY_TYPES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+WORDS = [
+    'largest', 'moon', 'planet', 'river', 'ocean', 'painter', 'composer', 'empire', 'battle',
+    'element', 'mountain', 'desert', 'novel', 'player', 'team', 'world', 'cup', 'first', 'city',
+    'country', 'capital', 'king', 'queen', 'century', 'war', 'island', 'star', 'movie', 'actor'
+]
+# the unpaginated category listing returns a sixth of the table, so it only runs on small datasets
+MAX_ROWS_FOR_FULL_LISTINGS = 100000
+
+'''
+seed(rows)
+    fills the database with the six categories and synthetic questions until it holds rows questions
+'''
+
+
+def seed(rows):
+    create_schema()
+    if Category.query.count() == 0:
+        for category_type in CATEGORY_TYPES:
+            db.session.add(Category(category_type))
+        db.session.commit()
+
+    category_ids = [category.id for category in Category.query.order_by(Category.id)]
+    generator = random.Random(rows)
+    existing = db.session.query(db.func.count(Question.id)).scalar()
+
+    for start in range(existing, rows, 10000):
+        db.session.execute(Question.__table__.insert(), [
+            {
+                'question': 'Which ' + ' '.join(generator.choice(WORDS) for _ in range(6)) + f' {index}?',
+                'answer': generator.choice(WORDS),
+                'category': generator.choice(category_ids),
+                'difficulty': generator.randint(1, 5)
+            }
+            for index in range(start, min(start + 10000, rows))
+        ])
+        db.session.commit()
+
+    # the bulk inserts bypass the listeners keeping the question counts and the change log
+    record_new_questions(db.session.connection())
+    db.session.commit()
+    reconcile_question_counts()
+
+    return category_ids
+
+
+'''
+get_scenarios(rows, category_ids)
+    returns the (name, method, path, json body) requests of the suite
+'''
+
+
+def get_scenarios(rows, category_ids):
+    last_page = max(1, (rows + 9) // 10)
+    question_ids = [question_id for question_id, in db.session.query(Question.id).limit(20)]
+
+    scenarios = [
+        ('get_questions first page', 'GET', '/api/v1/questions?page=1', None),
+        ('get_questions last page', 'GET', f'/api/v1/questions?page={last_page}', None),
+        ('get_questions cursor', 'GET', '/api/v1/questions?limit=10&after=' + cursor_after(rows), None),
+        ('search_questions page', 'POST', '/api/v1/questions/searches?page=1&per_page=10', {'search_term': 'largest moon'}),
+        ('search_questions rare term', 'POST', '/api/v1/questions/searches', {'search_term': f' {rows // 2}?'}),
+        ('get_category_questions page', 'GET', f'/api/v1/categories/{category_ids[0]}/questions?page=1&per_page=10', None),
+        ('play_quiz', 'POST', '/api/v1/quizzes', {'previous_questions': question_ids, 'quiz_category': None}),
+        ('play_quiz category', 'POST', '/api/v1/quizzes', {'previous_questions': question_ids, 'quiz_category': {'id': category_ids[0]}})
+    ]
+    if rows <= MAX_ROWS_FOR_FULL_LISTINGS:
+        scenarios.append(('get_category_questions all', 'GET', f'/api/v1/categories/{category_ids[0]}/questions', None))
+
+    return scenarios
+
+
+def cursor_after(rows):
+    return encode_cursor(max(0, rows - 10))
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def summarize(timings, elapsed, peak_memory):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'rps': len(timings) / elapsed if elapsed > 0 else 0,
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'peak_memory_kib': peak_memory / 1024 if peak_memory is not None else None
+    }
+
+
+'''
+run_test_client(app, scenario, requests)
+    sends the scenario requests through the Flask test client, then measures the
+    peak memory allocated by a single request with tracemalloc
+'''
+
+
+def run_test_client(app, scenario, requests):
+    name, method, path, body = scenario
+    client = app.test_client()
+
+    def send():
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        assert response.status_code == 200, f'{name}: {response.status_code}'
+
+    send()
+    timings = []
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        request_started_at = time.perf_counter()
+        send()
+        timings.append(time.perf_counter() - request_started_at)
+    elapsed = time.perf_counter() - started_at
+
+    tracemalloc.start()
+    send()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return summarize(timings, elapsed, peak_memory)
+
+
+'''
+run_wsgi_server(port, scenario, requests, concurrency)
+    sends the scenario requests over HTTP from concurrency client threads. The server runs
+    in this process next to the clients, so the memory of a single request is not measured.
+'''
+
+
+def run_wsgi_server(port, scenario, requests, concurrency):
+    name, method, path, body = scenario
+    payload = json.dumps(body).encode('utf-8') if body is not None else None
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    timings = []
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+
+    def worker():
+        thread_timings = []
+        for _ in range(per_thread):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            request_started_at = time.perf_counter()
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            thread_timings.append(time.perf_counter() - request_started_at)
+            connection.close()
+            assert response.status == 200, f'{name}: {response.status}'
+        with lock:
+            timings.extend(thread_timings)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+
+    return summarize(timings, elapsed, None)
+
+
+def run_dataset(dataset, args):
+    rows = DATASETS[dataset]
+    database_url = args.database_url.format(rows=rows)
+    app = create_app({'DATABASE_URL': database_url})
+    results = {'test_client': {}, 'wsgi_server': {}}
+
+    with app.app_context():
+        started_at = time.perf_counter()
+        category_ids = seed(rows)
+        print(f'\n{dataset}: {rows} questions in {database_url} (seeded in {time.perf_counter() - started_at:.1f} s)')
+        scenarios = get_scenarios(rows, category_ids)
+
+    for scenario in scenarios:
+        with app.app_context():
+            results['test_client'][scenario[0]] = run_test_client(app, scenario, args.requests)
+
+    # one access log line per request would dominate the measurements
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        for scenario in scenarios:
+            results['wsgi_server'][scenario[0]] = run_wsgi_server(server.server_port, scenario, args.requests, args.concurrency)
+    finally:
+        server.shutdown()
+
+    return results
+
+
+def print_results(dataset, results, baseline):
+    print(f'{"mode":<13}{"scenario":<30}{"rps":>9}{"p50 ms":>9}{"p99 ms":>9}{"peak KiB":>10}  vs baseline p99 / rps')
+    for mode, scenarios in results.items():
+        for name, result in scenarios.items():
+            peak_memory = f'{result["peak_memory_kib"]:.1f}' if result['peak_memory_kib'] is not None else 'n/a'
+            line = f'{mode:<13}{name:<30}{result["rps"]:>9.1f}{result["p50_ms"]:>9.2f}{result["p99_ms"]:>9.2f}{peak_memory:>10}'
+            base = baseline.get(dataset, {}).get(mode, {}).get(name)
+            if base is not None:
+                line += f'  {change(base["p99_ms"], result["p99_ms"]):>+7.1%} / {change(base["rps"], result["rps"]):>+7.1%}'
+            print(line)
+
+
+def change(before, after):
+    return (after - before) / before if before else 0
+
+
+'''
+find_regressions(results, baseline, tolerance)
+    returns the scenarios whose p99 latency grew, or whose throughput dropped, by more than tolerance
+'''
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for dataset, modes in results.items():
+        for mode, scenarios in modes.items():
+            for name, result in scenarios.items():
+                base = baseline.get(dataset, {}).get(mode, {}).get(name)
+                if base is None:
+                    continue
+                if change(base['p99_ms'], result['p99_ms']) > tolerance or change(base['rps'], result['rps']) < -tolerance:
+                    regressions.append(f'{dataset} {mode} {name}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the read endpoints')
+    parser.add_argument('--datasets', default='1k,100k', help='comma separated, out of ' + ', '.join(DATASETS))
+    parser.add_argument('--database-url', default='sqlite:////tmp/trivia_bench_{rows}.db')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario and mode')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads against the WSGI server')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH', help='baseline to compare against, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative change against the baseline')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    for dataset in args.datasets.split(','):
+        results[dataset] = run_dataset(dataset, args)
+        print_results(dataset, results[dataset], baseline)
+
+    print(f'\nprocess peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB')
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f'saved baseline to {args.save_baseline}')
+
+    if args.compare:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,109 @@
-from flask import Flask, abort, jsonify, request
+from flask import Flask, Response, abort, jsonify, request, stream_with_context
 from flask_cors import CORS
+from flask_migrate import Migrate, stamp, upgrade
+import click
+import collections.abc
+import io
+import os
 import random
-import collections
 
-from models import setup_db, Question, Category
+from models import setup_db, create_schema, create_search_indexes, get_pool_stats, get_question_count, read_only, reconcile_question_counts, Question, Category
+from flaskr.admission import admission_controlled, create_admission_controller
+from flaskr.bulk import IMPORT_FORMATS, delete_questions, export_questions, import_questions, read_questions, validate_question_data
+from flaskr.cache import get_category_cache, get_question_count_cache
+from flaskr.changes import get_question_changes
+from flaskr.compression import init_compression
+from flaskr.fixtures import load_fixture
+from flaskr.group_commit import DeleteQuestion, InsertQuestion, create_group_committer
+from flaskr.metrics import init_metrics
+from flaskr.pagination import decode_cursor, encode_cursor, stream_questions
+from flaskr.quiz import draw_questions, get_difficulty_weights, get_question_index, pick_random_question, pick_random_questions
+from flaskr.response_cache import cached_response, create_response_cache
+from flaskr.search import SEARCH_MODES, iter_search_questions, search_questions as find_questions
+from flaskr.serialization import conditional_json_response, format_question_rows, json_response, question_rows
+from flaskr.sessions import create_session_store
+from flaskr.snapshot import build_snapshot, get_snapshot
 
 QUESTIONS_PER_PAGE = 10
+STREAM_BATCH_SIZE = 500
+IMPORT_BATCH_SIZE = 1000
+MAX_BATCH_IDS = 1000
+MAX_QUIZ_QUESTIONS = 50
+CHANGES_PER_PAGE = 100
+MAX_CHANGES_PER_PAGE = 1000
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(
+        DATABASE_URL=os.environ.get('DATABASE_URL'),
+        DATABASE_REPLICA_URL=os.environ.get('DATABASE_REPLICA_URL'),
+        DATABASE_POOL_SIZE=int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+        DATABASE_MAX_OVERFLOW=int(os.environ.get('DATABASE_MAX_OVERFLOW', 10)),
+        DATABASE_POOL_TIMEOUT=int(os.environ.get('DATABASE_POOL_TIMEOUT', 30)),
+        DATABASE_POOL_RECYCLE=int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)),
+        DATABASE_POOL_PRE_PING=os.environ.get('DATABASE_POOL_PRE_PING', 'true') == 'true',
+        DATABASE_STATEMENT_TIMEOUT=int(os.environ.get('DATABASE_STATEMENT_TIMEOUT', 0)),
+        QUESTION_INDEX_TTL=300,
+        CATEGORY_CACHE_TTL=300,
+        QUESTION_COUNT_CACHE_TTL=60,
+        SEARCH_MODE=os.environ.get('SEARCH_MODE', 'substring'),
+        SEARCH_INDEX_TTL=300,
+        QUIZ_SESSION_STORE=os.environ.get('QUIZ_SESSION_STORE', 'memory'),
+        QUIZ_SESSION_TTL=int(os.environ.get('QUIZ_SESSION_TTL', 3600)),
+        REDIS_URL=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+        METRICS_SERVER_TIMING=os.environ.get('METRICS_SERVER_TIMING', 'false') == 'true',
+        JSON_ENCODER=os.environ.get('JSON_ENCODER', 'auto'),
+        COMPRESSION_ENCODINGS=os.environ.get('COMPRESSION_ENCODINGS', 'br,zstd,gzip'),
+        COMPRESSION_MIN_SIZE=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+        COMPRESSION_CACHE_BYTES=int(os.environ.get('COMPRESSION_CACHE_BYTES', 16 * 1024 * 1024)),
+        ASGI_THREADS=int(os.environ.get('ASGI_THREADS', 8)),
+        RESPONSE_CACHE=os.environ.get('RESPONSE_CACHE', 'none'),
+        RESPONSE_CACHE_TTL=int(os.environ.get('RESPONSE_CACHE_TTL', 60)),
+        RESPONSE_CACHE_TIMEOUT=float(os.environ.get('RESPONSE_CACHE_TIMEOUT', 0.1)),
+        QUESTION_SNAPSHOT_PATH=os.environ.get('QUESTION_SNAPSHOT_PATH'),
+        QUESTION_SNAPSHOT_DELAY=float(os.environ.get('QUESTION_SNAPSHOT_DELAY', 0.5)),
+        WRITE_BATCHING=os.environ.get('WRITE_BATCHING', 'false') == 'true',
+        WRITE_BATCH_SIZE=int(os.environ.get('WRITE_BATCH_SIZE', 100)),
+        WRITE_BATCH_LATENCY=float(os.environ.get('WRITE_BATCH_LATENCY', 0.005)),
+        ADMISSION_CONTROL=os.environ.get('ADMISSION_CONTROL', 'none'),
+        ADMISSION_CONCURRENCY=os.environ.get('ADMISSION_CONCURRENCY', 'search_questions=8,play_quiz=16'),
+        ADMISSION_RATE=os.environ.get('ADMISSION_RATE', 'search_questions=10/20,play_quiz=5/10'),
+        ADMISSION_RETRY_AFTER=int(os.environ.get('ADMISSION_RETRY_AFTER', 1)),
+        ADMISSION_TIMEOUT=float(os.environ.get('ADMISSION_TIMEOUT', 0.05))
+    )
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
     db = setup_db(app)
+    migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations'), render_as_batch=True)
+    quiz_sessions = create_session_store(app.config)
+    app.extensions['response_cache'] = create_response_cache(app.config)
+    app.extensions['group_commit'] = create_group_committer(app)
 
     '''
     Set up CORS. Allow '*' for origins.
     '''
     cors = CORS(app, resources={r'/api/*': {'origins': '*'}})
 
+    '''
+    Record per-route latency, SQL statements and payload size, served on /metrics.
+    '''
+    init_metrics(app)
+
+    '''
+    Limit the concurrent requests per route and the request rate per client of the expensive
+    routes, shedding the others with 503 and 429 responses, and count them in the metrics.
+    '''
+    app.extensions['admission'] = create_admission_controller(app.config, app.extensions['metrics'])
+
+    '''
+    Compress large responses with the best encoding the client accepts. Registered after
+    the metrics, so that it runs before them and the recorded payload size is the one sent.
+    '''
+    init_compression(app)
+
     '''
     Use the after_request decorator to set Access-Control-Allow
     '''
@@ -27,24 +113,56 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PATCH, DELETE, OPTIONS')
         return response
 
+    '''
+    Returns the (page, per_page) request arguments, or None if neither was given.
+    page must be larger than zero and per_page must be between one and one hundred.
+    '''
+    def get_pagination():
+        if 'page' not in request.args and 'per_page' not in request.args:
+            return None
+
+        page = request.args.get('page', default=1, type=int)
+        per_page = request.args.get('per_page', default=QUESTIONS_PER_PAGE, type=int)
+
+        if page < 1 or per_page < 1 or per_page > 100:
+            abort(422)
+
+        return page, per_page
+
+    def is_streaming():
+        return request.args.get('stream', default='false') == 'true'
+
+    '''
+    Returns the distinct question ids of a batch request in their given order, or None unless
+    there are between one and MAX_BATCH_IDS of them and all of them are integers.
+    '''
+    def get_batch_ids(ids):
+        if not isinstance(ids, list) or len(ids) == 0 or len(ids) > MAX_BATCH_IDS:
+            return None
+        if not all(isinstance(question_id, int) and not isinstance(question_id, bool) for question_id in ids):
+            return None
+
+        return list(dict.fromkeys(ids))
+
     '''
     Create an endpoint to handle GET requests 
     for all available categories.
     '''
     @app.route('/api/v1/categories')
+    @read_only
+    @cached_response('categories')
     def get_categories():
         try:
-            body = {}
-            for category in Category.query.all():
-                body[category.id] = category.type
-
-            return jsonify({
-                'success': True,
-                'categories': body
-            })
+            cached_categories = get_category_cache().get()
         except:
             abort(404)
 
+        # the body is serialized once per cache fill and revalidated with a strong ETag
+        response = Response(cached_categories.body, mimetype='application/json')
+        response.set_etag(cached_categories.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
     '''
     Create an endpoint to handle GET requests for questions, 
     including pagination (every 10 questions). 
@@ -57,28 +175,112 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions. 
     '''
     @app.route('/api/v1/questions')
+    @admission_controlled
+    @read_only
+    @cached_response('questions', 'categories')
     def get_questions():
-        page = request.args.get('page', default=1, type=int)
-        per_page = request.args.get('per_page', default=10, type=int)
+        if 'ids' in request.args:
+            return get_questions_by_ids()
+
+        # cursor mode seeks on the primary key, so deep pages cost the same as the first one
+        if 'after' in request.args or 'limit' in request.args:
+            return get_questions_after_cursor()
+
+        page, per_page = get_pagination() or (1, QUESTIONS_PER_PAGE)
+
+        # the snapshot holds the questions ordered by id, so a page is a range of its positions
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            questions = snapshot.rows(range(min((page - 1) * per_page, len(snapshot)), min(page * per_page, len(snapshot))))
+            total_questions = len(snapshot)
+        else:
+            questions = question_rows(Question.query.order_by(Question.id)).limit(per_page).offset((page - 1) * per_page).all()
+            total_questions = get_question_count_cache().get()
 
-        # page must be larger than zero and per_page must be less or equal to one hundred
-        if page < 1 or per_page > 100:
+        return conditional_json_response({
+            'success': True,
+            'questions': format_question_rows(questions),
+            'total_questions': total_questions,
+            'categories': get_category_cache().get().categories,
+            'current_category': None
+        })
+
+    def get_questions_by_ids():
+        try:
+            ids = [int(question_id) for question_id in request.args['ids'].split(',')]
+        except ValueError:
             return abort(422)
 
-        questions_query = Question.query.paginate(page=page, error_out=False, max_per_page=per_page)
-        formatted_questions = [question.format() for question in questions_query.items]
+        question_ids = get_batch_ids(ids)
 
-        categories = Category.query.all()
-        formatted_categories = {}
-        for category in categories:
-            formatted_categories[category.id] = category.type
+        # ids must be between one and MAX_BATCH_IDS comma separated integers
+        if question_ids is None:
+            return abort(422)
 
-        return jsonify({
+        rows = {row.id: row for row in question_rows(Question.query.filter(Question.id.in_(question_ids)))}
+
+        return conditional_json_response({
+            'success': True,
+            'questions': format_question_rows(rows[question_id] for question_id in question_ids if question_id in rows),
+            'missing_ids': [question_id for question_id in question_ids if question_id not in rows]
+        })
+
+    def get_questions_after_cursor():
+        limit = request.args.get('limit', default=QUESTIONS_PER_PAGE, type=int)
+        with_total = request.args.get('with_total', default='true') != 'false'
+
+        # limit must be between one and one hundred
+        if limit < 1 or limit > 100:
+            return abort(422)
+
+        questions_query = question_rows(Question.query.order_by(Question.id))
+
+        if request.args.get('after'):
+            try:
+                after_question_id = decode_cursor(request.args['after'])
+            except ValueError:
+                return abort(422)
+            questions_query = questions_query.filter(Question.id > after_question_id)
+
+        # one extra row tells whether there is a next page without counting
+        questions = questions_query.limit(limit + 1).all()
+        has_next = len(questions) > limit
+        questions = questions[:limit]
+
+        body = {
             'success': True,
-            'questions': formatted_questions,
-            'total_questions': questions_query.total,
-            'categories': formatted_categories,
+            'questions': format_question_rows(questions),
+            'next_cursor': encode_cursor(questions[-1].id) if has_next else None,
+            'categories': get_category_cache().get().categories,
             'current_category': None
+        }
+        if with_total:
+            body['total_questions'] = get_question_count_cache().get()
+
+        return conditional_json_response(body)
+
+    '''
+    GET endpoint returning the questions changed and deleted since a version, in batches of
+    at most limit changes, so that clients sync the changes instead of paging every question.
+    '''
+    @app.route('/api/v1/questions/changes')
+    @read_only
+    def get_questions_changes():
+        since = request.args.get('since', default=0, type=int)
+        limit = request.args.get('limit', default=CHANGES_PER_PAGE, type=int)
+
+        # since must not be negative and limit must be between one and MAX_CHANGES_PER_PAGE
+        if since < 0 or limit < 1 or limit > MAX_CHANGES_PER_PAGE:
+            return abort(422)
+
+        questions, deleted_ids, version, has_more = get_question_changes(since, limit)
+
+        return json_response({
+            'success': True,
+            'questions': format_question_rows(questions),
+            'deleted_ids': deleted_ids,
+            'version': version,
+            'has_more': has_more
         })
 
     '''
@@ -89,6 +291,15 @@ def create_app(test_config=None):
     '''
     @app.route('/api/v1/questions/<int:question_id>', methods=['DELETE'])
     def delete_question(question_id):
+        # with write batching the delete is committed together with the concurrent writes
+        group_committer = app.extensions['group_commit']
+        if group_committer is not None:
+            if not group_committer.submit(DeleteQuestion(question_id)):
+                return abort(404)
+            return jsonify({
+                'success': True
+            })
+
         question = Question.query.filter(Question.id == question_id).one_or_none()
 
         # question must exist
@@ -100,6 +311,31 @@ def create_app(test_config=None):
             'success': True
         })
 
+    '''
+    DELETE endpoint to delete a batch of questions by id in a single transaction.
+    '''
+    @app.route('/api/v1/questions', methods=['DELETE'])
+    def batch_delete_questions():
+        request_body = request.get_json(silent=True) or {}
+
+        # request body must be an object
+        if not isinstance(request_body, dict):
+            return abort(422)
+
+        question_ids = get_batch_ids(request_body.get('ids'))
+
+        # ids must be a list of between one and MAX_BATCH_IDS integers
+        if question_ids is None:
+            return abort(422)
+
+        deleted_ids = set(delete_questions(question_ids))
+
+        return jsonify({
+            'success': True,
+            'deleted_ids': [question_id for question_id in question_ids if question_id in deleted_ids],
+            'missing_ids': [question_id for question_id in question_ids if question_id not in deleted_ids]
+        })
+
     '''
     Create an endpoint to POST a new question, 
     which will require the question and answer text, 
@@ -111,42 +347,135 @@ def create_app(test_config=None):
     '''
     @app.route('/api/v1/questions', methods=['POST'])
     def create_question():
-        required_request_data = ['question', 'answer', 'difficulty', 'category']
         request_body = request.get_json()
 
-        for key in required_request_data:
-            # all required request data must exist
-            if key not in request_body or request_body[key] is None or request_body[key] == '':
-                return abort(422)
+        # all required request data must exist
+        if validate_question_data(request_body) is not None:
+            return abort(422)
 
-        question = Question(
-            request_body['question'],
-            request_body['answer'],
-            request_body['category'],
-            request_body['difficulty']
-        )
-        question.insert()
+        # category must be an existing category id
+        try:
+            category_id = int(request_body['category'])
+        except (TypeError, ValueError):
+            return abort(422)
+        if category_id not in get_category_cache().get().categories:
+            return abort(422)
+
+        # with write batching the insert is committed together with the concurrent writes
+        group_committer = app.extensions['group_commit']
+        if group_committer is not None:
+            group_committer.submit(InsertQuestion(request_body['question'], request_body['answer'], category_id, request_body['difficulty']))
+        else:
+            question = Question(
+                request_body['question'],
+                request_body['answer'],
+                category_id,
+                request_body['difficulty']
+            )
+            question.insert()
 
         return jsonify({
             'success': True
         })
 
+    '''
+    POST endpoint to import questions in bulk from an NDJSON (application/x-ndjson)
+    or CSV (text/csv) request body. Rows are validated like in create_question,
+    invalid rows are skipped and reported, valid rows are inserted in batches.
+    '''
+    @app.route('/api/v1/questions/imports', methods=['POST'])
+    def bulk_import_questions():
+        format = IMPORT_FORMATS.get(request.mimetype)
+        batch_size = request.args.get('batch_size', default=IMPORT_BATCH_SIZE, type=int)
+
+        # request body must be NDJSON or CSV and batch_size must be between one and ten thousand
+        if format is None or batch_size < 1 or batch_size > 10000:
+            return abort(422)
+
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        imported, error_count, errors = import_questions(
+            read_questions(stream, format, get_category_cache().get().categories),
+            batch_size,
+            lambda imported: app.logger.info('Imported %d questions', imported)
+        )
+
+        return jsonify({
+            'success': True,
+            'imported': imported,
+            'failed': error_count,
+            'errors': errors
+        })
+
+    '''
+    GET endpoint to export all questions as NDJSON or CSV, streamed from a server-side cursor.
+    '''
+    @app.route('/api/v1/questions/exports')
+    @read_only
+    def bulk_export_questions():
+        format = request.args.get('format', default='ndjson')
+
+        # format must be ndjson or csv
+        if format not in ('ndjson', 'csv'):
+            return abort(422)
+
+        mimetype = 'application/x-ndjson' if format == 'ndjson' else 'text/csv'
+        return Response(stream_with_context(export_questions(format, STREAM_BATCH_SIZE)), mimetype=mimetype)
+
     '''
     POST endpoint to get questions based on a search term. 
     It should return any questions for whom the search term 
-    is a substring of the question. 
+    is a substring of the question, or in fulltext mode any questions
+    containing every word of the search term, ordered by rank.
     '''
     @app.route('/api/v1/questions/searches', methods=['POST'])
+    @admission_controlled
+    @read_only
+    @cached_response('questions')
     def search_questions():
-        request_body = request.get_json()
-        search_term = request_body['search_term']
-        questions = Question.query.filter(Question.question.ilike(f'%{search_term}%')).all()
-        formatted_questions = [question.format() for question in questions]
+        request_body = request.get_json(silent=True) or {}
 
-        return jsonify({
+        # request body must be an object
+        if not isinstance(request_body, dict):
+            return abort(422)
+
+        search_term = request_body.get('search_term', '')
+        mode = request_body.get('mode', app.config['SEARCH_MODE'])
+
+        # search mode must be known
+        if mode not in SEARCH_MODES:
+            return abort(422)
+
+        # search term must be a string
+        if not isinstance(search_term, str):
+            return abort(422)
+
+        pagination = get_pagination()
+
+        if is_streaming():
+            questions = iter_search_questions(search_term, mode, STREAM_BATCH_SIZE)
+            body = stream_questions({'success': True, 'current_category': None}, questions)
+            return Response(stream_with_context(body), mimetype='application/json')
+
+        # the snapshot matches substrings without LIKE wildcards
+        snapshot = get_snapshot() if mode == 'substring' else None
+        if snapshot is not None and ('%' in search_term or '_' in search_term):
+            snapshot = None
+
+        if snapshot is not None:
+            positions = snapshot.search(search_term)
+            page, per_page = pagination or (1, len(positions))
+            questions = snapshot.rows(positions[(page - 1) * per_page:page * per_page])
+            total_questions = len(positions)
+        elif pagination is None:
+            questions, total_questions = find_questions(search_term, mode)
+        else:
+            page, per_page = pagination
+            questions, total_questions = find_questions(search_term, mode, (page - 1) * per_page, per_page)
+
+        return json_response({
             'success': True,
-            'questions': formatted_questions,
-            'total_questions': len(formatted_questions),
+            'questions': format_question_rows(questions),
+            'total_questions': total_questions,
             'current_category': None
         })
 
@@ -158,23 +487,61 @@ def create_app(test_config=None):
     category to be shown. 
     '''
     @app.route('/api/v1/categories/<int:category_id>/questions')
+    @admission_controlled
+    @read_only
+    @cached_response('categories', 'category:{category_id}')
     def get_category_questions(category_id):
+        if not is_streaming():
+            snapshot = get_snapshot()
+            if snapshot is not None:
+                return get_snapshot_category_questions(snapshot, category_id)
+
         category = Category.query.filter(Category.id == category_id).one_or_none()
 
         # category must exist
         if category is None:
             return abort(422)
 
-        questions = Question.query.filter_by(category=str(category.id)).all()
-        formatted_questions = [question.format() for question in questions]
+        questions_query = question_rows(Question.query.filter_by(category=category.id).order_by(Question.id))
+        pagination = get_pagination()
 
-        return jsonify({
+        if is_streaming():
+            questions = questions_query.execution_options(stream_results=True).yield_per(STREAM_BATCH_SIZE)
+            body = stream_questions({'success': True, 'current_category': category.format()}, questions)
+            return Response(stream_with_context(body), mimetype='application/json')
+
+        if pagination is None:
+            questions = questions_query.all()
+            total_questions = len(questions)
+        else:
+            page, per_page = pagination
+            questions = questions_query.limit(per_page).offset((page - 1) * per_page).all()
+            total_questions = get_question_count(category.id)
+
+        return conditional_json_response({
             'success': True,
-            'questions': formatted_questions,
-            'total_questions': len(questions),
+            'questions': format_question_rows(questions),
+            'total_questions': total_questions,
             'current_category': category.format()
         })
 
+    def get_snapshot_category_questions(snapshot, category_id):
+        category = snapshot.format_category(category_id)
+
+        # category must exist
+        if category is None:
+            return abort(422)
+
+        positions = snapshot.category_positions(category_id)
+        page, per_page = get_pagination() or (1, len(positions))
+
+        return conditional_json_response({
+            'success': True,
+            'questions': format_question_rows(snapshot.rows(positions[(page - 1) * per_page:page * per_page])),
+            'total_questions': len(positions),
+            'current_category': category
+        })
+
     '''
     Create a POST endpoint to get questions to play the quiz. 
     This endpoint should take category and previous question parameters 
@@ -186,6 +553,8 @@ def create_app(test_config=None):
     and shown whether they were correct or not. 
     '''
     @app.route('/api/v1/quizzes', methods=['POST'])
+    @admission_controlled
+    @read_only
     def play_quiz():
         request_body = request.get_json()
 
@@ -194,25 +563,140 @@ def create_app(test_config=None):
             return abort(422)
 
         # request body must contain 'previous_questions' field with iterable value
-        if not ('previous_questions' in request_body) or not isinstance(request_body['previous_questions'], collections.Iterable):
+        if not ('previous_questions' in request_body) or not isinstance(request_body['previous_questions'], collections.abc.Iterable):
             return abort(422)
 
         previous_questions = request_body['previous_questions']
+        quiz_category = None
 
         if 'quiz_category' in request_body and not (request_body['quiz_category'] is None):
-            quiz_category = request_body['quiz_category']
-            not_taken_questions = Question.query.filter(
-                Question.category == str(quiz_category['id']),
-                Question.id.notin_(previous_questions)
-            ).all()
-        else:
-            not_taken_questions = Question.query.filter(Question.id.notin_(previous_questions)).all()
+            quiz_category = request_body['quiz_category']['id']
+
+        # optional difficulty_weights or answers for a weighted draw of the difficulty
+        try:
+            difficulty_weights = get_difficulty_weights(request_body)
+        except ValueError:
+            return abort(422)
+
+        # optional count of distinct questions to return at once, so that a client prefetches a round
+        count = request_body.get('count')
+        if count is not None and (not isinstance(count, int) or isinstance(count, bool) or count < 1 or count > MAX_QUIZ_QUESTIONS):
+            return abort(422)
+
+        snapshot = get_snapshot()
+        if count is not None:
+            if snapshot is not None:
+                questions = pick_snapshot_questions(snapshot, quiz_category, previous_questions, count, difficulty_weights)
+            else:
+                questions = format_question_rows(pick_random_questions(quiz_category, previous_questions, count, difficulty_weights))
+            return jsonify({
+                'success': True,
+                'questions': questions
+            })
+
+        if snapshot is not None:
+            questions = pick_snapshot_questions(snapshot, quiz_category, previous_questions, 1, difficulty_weights)
+            return jsonify({
+                'success': True,
+                'question': questions[0] if len(questions) > 0 else None
+            })
+
+        random_not_taken_question = pick_random_question(quiz_category, previous_questions, difficulty_weights)
+
+        return jsonify({
+            'success': True,
+            'question': random_not_taken_question.format() if random_not_taken_question is not None else None
+        })
+
+    def pick_snapshot_questions(snapshot, quiz_category, previous_questions, count, difficulty_weights):
+        try:
+            category = None if quiz_category is None else int(quiz_category)
+        except (TypeError, ValueError):
+            return []
+
+        question_ids = draw_questions(snapshot, count, category, set(previous_questions), difficulty_weights)
+        return format_question_rows(snapshot.row(snapshot.find(question_id)) for question_id in question_ids)
+
+    '''
+    POST endpoint to start a quiz session. The session holds a shuffled ordering
+    of the question ids within the given category, if provided, so that the client
+    only has to send the session id to get the next question.
+    '''
+    @app.route('/api/v1/quizzes/sessions', methods=['POST'])
+    @read_only
+    def create_quiz_session():
+        request_body = request.get_json(silent=True) or {}
+
+        # request body must be an object
+        if not isinstance(request_body, dict):
+            return abort(422)
 
-        random_not_taken_question = random.choice(not_taken_questions)
+        quiz_category = request_body.get('quiz_category')
+        if quiz_category is not None:
+            # quiz_category must be a category with an integer id
+            if not isinstance(quiz_category, dict) or not isinstance(quiz_category.get('id'), int) or isinstance(quiz_category['id'], bool):
+                return abort(422)
+            quiz_category = quiz_category['id']
+
+        question_ids = list(get_question_index().ids(quiz_category))
+        random.shuffle(question_ids)
+        session_id = quiz_sessions.create(question_ids)
 
         return jsonify({
             'success': True,
-            'question': random_not_taken_question.format()
+            'session_id': session_id,
+            'total_questions': len(question_ids)
+        })
+
+    '''
+    POST endpoint to advance a quiz session and get its next question.
+    '''
+    @app.route('/api/v1/quizzes/sessions/<session_id>/next', methods=['POST'])
+    @read_only
+    def next_quiz_session_question(session_id):
+        while True:
+            try:
+                question_id = quiz_sessions.next(session_id)
+            except KeyError:
+                # session must exist and must not be expired
+                return abort(404)
+
+            if question_id is None:
+                question = None
+                break
+
+            # skip questions which were deleted after the session was created
+            question = Question.query.get(question_id)
+            if question is not None:
+                break
+
+        return jsonify({
+            'success': True,
+            'question': question.format() if question is not None else None
+        })
+
+    '''
+    DELETE endpoint to end a quiz session.
+    '''
+    @app.route('/api/v1/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def delete_quiz_session(session_id):
+        # session must exist
+        if not quiz_sessions.delete(session_id):
+            return abort(404)
+
+        return jsonify({
+            'success': True
+        })
+
+    '''
+    GET endpoint to get the connection pool statistics of the primary database
+    and of the read replica, if configured.
+    '''
+    @app.route('/api/v1/stats/pool')
+    def get_database_pool_stats():
+        return jsonify({
+            'success': True,
+            'pools': get_pool_stats(app)
         })
 
     '''
@@ -251,6 +735,17 @@ def create_app(test_config=None):
             'message': 'Unprocessable entity'
         }), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify({
+            'success': False,
+            'error': 429,
+            'message': 'Too many requests'
+        })
+        if getattr(error, 'retry_after', None) is not None:
+            response.headers['Retry-After'] = str(error.retry_after)
+        return response, 429
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return jsonify({
@@ -259,4 +754,98 @@ def create_app(test_config=None):
             'message': 'Internal server error'
         }), 500
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        response = jsonify({
+            'success': False,
+            'error': 503,
+            'message': 'Service unavailable'
+        })
+        if getattr(error, 'retry_after', None) is not None:
+            response.headers['Retry-After'] = str(error.retry_after)
+        return response, 503
+
+    '''
+    CLI command creating the schema of an empty database and marking it as migrated to the
+    latest revision, or applying the pending migrations to an existing database. With --fixture
+    the data of a pg_dump file like trivia.psql is loaded into the newly created schema.
+    '''
+    @app.cli.command('init-db')
+    @click.option('--fixture', type=click.Path(exists=True, dir_okay=False), default=None, help='pg_dump file loaded into a new database')
+    def init_db_command(fixture):
+        if create_schema():
+            stamp()
+            click.echo('Created the database schema')
+            if fixture is not None:
+                for table, count in load_fixture(fixture).items():
+                    click.echo(f'Loaded {count} rows into {table}')
+        else:
+            upgrade()
+            click.echo('Migrated the database schema')
+
+    '''
+    CLI command creating the search indexes on an existing PostgreSQL database.
+    '''
+    @app.cli.command('create-search-indexes')
+    def create_search_indexes_command():
+        if create_search_indexes():
+            click.echo('Created search indexes')
+        else:
+            click.echo('Search indexes are only used on PostgreSQL')
+
+    '''
+    CLI command recounting the questions of every category and correcting the question counts which drifted.
+    '''
+    @app.cli.command('reconcile-question-counts')
+    def reconcile_question_counts_command():
+        drifted = reconcile_question_counts()
+        for category, stored_count, count in drifted:
+            click.echo(f'Category {category}: {stored_count} -> {count}')
+        click.echo(f'Corrected {len(drifted)} question counts')
+
+    '''
+    CLI commands importing and exporting questions in bulk.
+    '''
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'format', type=click.Choice(['ndjson', 'csv']), default=None, help='defaults to the file extension')
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+    def import_questions_command(path, format, batch_size):
+        if format is None:
+            format = 'csv' if path.endswith('.csv') else 'ndjson'
+
+        with open(path, encoding='utf-8', newline='') as stream:
+            imported, error_count, errors = import_questions(
+                read_questions(stream, format, get_category_cache().get().categories),
+                batch_size,
+                lambda imported: click.echo(f'Imported {imported} questions')
+            )
+
+        for error in errors:
+            click.echo(f'Line {error["line"]}: {error["message"]}', err=True)
+        click.echo(f'Imported {imported} questions, skipped {error_count} invalid rows')
+
+    '''
+    CLI command building the question snapshot at QUESTION_SNAPSHOT_PATH, or at the given path.
+    '''
+    @app.cli.command('build-snapshot')
+    @click.argument('path', required=False, type=click.Path(dir_okay=False, writable=True))
+    def build_snapshot_command(path):
+        path = path or app.config['QUESTION_SNAPSHOT_PATH']
+        if not path:
+            raise click.UsageError('Set QUESTION_SNAPSHOT_PATH or give the path of the snapshot')
+
+        click.echo(f'Wrote {build_snapshot(path)} questions to {path}')
+
+    @app.cli.command('export-questions')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--format', 'format', type=click.Choice(['ndjson', 'csv']), default=None, help='defaults to the file extension')
+    def export_questions_command(path, format):
+        if format is None:
+            format = 'csv' if path.endswith('.csv') else 'ndjson'
+
+        with open(path, 'w', encoding='utf-8', newline='') as stream:
+            for chunk in export_questions(format, STREAM_BATCH_SIZE):
+                stream.write(chunk)
+
     return app
@@ -0,0 +1,285 @@
+import functools
+import logging
+import math
+import secrets
+import threading
+import time
+
+from flask import current_app, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+logger = logging.getLogger(__name__)
+
+# rate limit buckets kept in memory before the full ones are evicted
+MAX_MEMORY_BUCKETS = 100000
+
+'''
+next_arrival(arrival, now, rate, burst)
+    the token bucket of a client as the time at which its bucket is full again (GCRA): every
+    request adds 1 / rate seconds to it, and a request is admitted unless that would put it
+    more than burst requests ahead of now. Returns the new arrival time and the seconds to
+    wait before the request would be admitted, 0 if it is admitted.
+'''
+
+
+def next_arrival(arrival, now, rate, burst):
+    interval = 1 / rate
+    arrival = max(arrival, now) + interval
+    return arrival, max(0, arrival - now - burst * interval)
+
+
+'''
+MemoryAdmissionBackend
+    keeps the requests in flight per route and the token buckets per client in the current
+    process, so that the limits apply to every worker process on its own
+'''
+
+
+class MemoryAdmissionBackend:
+    blocking = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.arrivals = {}
+
+    def acquire(self, route, limit):
+        '''
+        Returns a ticket for a request of the route if fewer than limit are in flight, or None.
+        '''
+        with self.lock:
+            if self.in_flight.get(route, 0) >= limit:
+                return None
+            self.in_flight[route] = self.in_flight.get(route, 0) + 1
+            return route
+
+    def release(self, route, ticket):
+        with self.lock:
+            self.in_flight[route] -= 1
+
+    def take(self, key, rate, burst):
+        '''
+        Takes a token from the bucket of key and returns 0, or the seconds until one is available.
+        '''
+        now = time.monotonic()
+        with self.lock:
+            if len(self.arrivals) > MAX_MEMORY_BUCKETS:
+                # a bucket which is full again is the same as a new one
+                self.arrivals = {key: arrival for key, arrival in self.arrivals.items() if arrival > now}
+
+            arrival, retry_after = next_arrival(self.arrivals.get(key, now), now, rate, burst)
+            if retry_after == 0:
+                self.arrivals[key] = arrival
+            return retry_after
+
+
+'''
+RedisAdmissionBackend
+    shares the limits between all workers and hosts through redis. The requests in flight are
+    members of a sorted set per route, scored by the end of a lease, so that the slots of a
+    worker which died with requests in flight free up after lease seconds. The arrival time
+    of every bucket is updated in a WATCH transaction and expires once the bucket is full.
+'''
+
+
+class RedisAdmissionBackend:
+    blocking = True
+
+    def __init__(self, client, prefix='trivia:admission:', lease=60):
+        self.client = client
+        self.prefix = prefix
+        self.lease = lease
+
+    def acquire(self, route, limit):
+        key = self.prefix + 'in-flight:' + route
+        ticket = secrets.token_hex(8)
+        now = time.time()
+
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zadd(key, {ticket: now + self.lease})
+        pipe.zcard(key)
+        pipe.expire(key, self.lease)
+        _, _, in_flight, _ = pipe.execute()
+
+        if in_flight > limit:
+            self.client.zrem(key, ticket)
+            return None
+        return ticket
+
+    def release(self, route, ticket):
+        self.client.zrem(self.prefix + 'in-flight:' + route, ticket)
+
+    def take(self, key, rate, burst):
+        key = self.prefix + 'rate:' + key
+
+        def update(pipe):
+            now = time.time()
+            stored_arrival = pipe.get(key)
+            arrival, retry_after = next_arrival(float(stored_arrival) if stored_arrival is not None else now, now, rate, burst)
+            if retry_after == 0:
+                pipe.multi()
+                pipe.set(key, repr(arrival), px=math.ceil((arrival - now) * 1000) + 1)
+            return retry_after
+
+        return self.client.transaction(update, key, value_from_callable=True)
+
+
+'''
+AdmissionController
+    admits the requests of the routes with limits: at most concurrency_limits[route] requests
+    of a route at once, or 503, and per client a token bucket of rate_limits[route] =
+    (requests per second, burst), or 429. Rejected requests are counted in shed_counter.
+    When the backend fails the requests are admitted, and it is retried after retry_interval seconds.
+'''
+
+
+class AdmissionController:
+    def __init__(self, backend, concurrency_limits, rate_limits, shed_counter, retry_after=1, retry_interval=5):
+        self.backend = backend
+        self.concurrency_limits = concurrency_limits
+        self.rate_limits = rate_limits
+        self.shed_counter = shed_counter
+        self.retry_after = retry_after
+        self.retry_interval = retry_interval
+        self.unavailable_until = 0
+
+    def is_limited(self, route):
+        return route in self.concurrency_limits or route in self.rate_limits
+
+    def admit(self, route, client):
+        '''
+        Returns the ticket of an admitted request, to be released once it is done, or None if
+        the route has no concurrency limit. Raises TooManyRequests or ServiceUnavailable, with
+        their retry_after, for rejected requests.
+        '''
+        if time.monotonic() < self.unavailable_until:
+            return None
+
+        try:
+            if route in self.rate_limits:
+                rate, burst = self.rate_limits[route]
+                retry_after = self.backend.take(f'{route}:{client}', rate, burst)
+                if retry_after > 0:
+                    self.shed_counter.inc({'route': route, 'reason': 'rate'})
+                    raise TooManyRequests(retry_after=max(1, math.ceil(retry_after)))
+
+            if route not in self.concurrency_limits:
+                return None
+
+            ticket = self.backend.acquire(route, self.concurrency_limits[route])
+        except TooManyRequests:
+            raise
+        except Exception as error:
+            return self.fail(error)
+
+        if ticket is None:
+            self.shed_counter.inc({'route': route, 'reason': 'concurrency'})
+            raise ServiceUnavailable(retry_after=self.retry_after)
+        return route, ticket
+
+    def release(self, ticket):
+        if ticket is None:
+            return
+
+        route, backend_ticket = ticket
+        try:
+            self.backend.release(route, backend_ticket)
+        except Exception as error:
+            self.fail(error)
+
+    def fail(self, error):
+        logger.warning('Admission control unavailable for %d seconds: %s', self.retry_interval, error)
+        self.unavailable_until = time.monotonic() + self.retry_interval
+        return None
+
+
+'''
+parse_limits(limits, parts)
+    returns the {route: limit} of a 'route=limit,...' setting, where a limit has parts values
+    separated by '/', like 'search_questions=10/20' for a rate and a burst. A dict is returned as it is.
+'''
+
+
+def parse_limits(limits, parts=1):
+    if isinstance(limits, dict):
+        return limits
+
+    parsed = {}
+    for item in (limits or '').split(','):
+        if not item.strip():
+            continue
+        route, _, values = item.partition('=')
+        values = [float(value) for value in values.split('/')]
+        if len(values) != parts:
+            raise ValueError(f'Invalid admission limit: {item}')
+        parsed[route.strip()] = int(values[0]) if parts == 1 else tuple(values)
+    return parsed
+
+
+'''
+create_admission_controller(config, registry)
+    creates the admission controller with the backend selected by the ADMISSION_CONTROL
+    setting, or returns None if it is 'none'
+'''
+
+
+def create_admission_controller(config, registry):
+    store = config.get('ADMISSION_CONTROL', 'none')
+
+    if store == 'none':
+        return None
+
+    if store == 'memory':
+        backend = MemoryAdmissionBackend()
+    elif store == 'redis':
+        import redis
+        timeout = config.get('ADMISSION_TIMEOUT', 0.05)
+        backend = RedisAdmissionBackend(redis.Redis.from_url(config['REDIS_URL'], socket_timeout=timeout, socket_connect_timeout=timeout))
+    else:
+        raise ValueError(f'Unknown admission control: {store}')
+
+    return AdmissionController(
+        backend,
+        parse_limits(config.get('ADMISSION_CONCURRENCY')),
+        parse_limits(config.get('ADMISSION_RATE'), parts=2),
+        registry.counter('trivia_requests_shed_total', 'Requests rejected by the admission control.'),
+        retry_after=config.get('ADMISSION_RETRY_AFTER', 1)
+    )
+
+
+'''
+admission_controlled(view)
+    admits the requests of a view through the admission controller of the application,
+    keyed by the view name and the client address. The slot of a request is held until its
+    response is closed, so streamed bodies count as in flight until they are sent.
+'''
+
+
+def admission_controlled(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        controller = current_app.extensions.get('admission')
+        # requests admitted by the ASGI application are only counted once
+        if controller is None or request.environ.get('trivia.admitted'):
+            return view(*args, **kwargs)
+
+        ticket = controller.admit(view.__name__, request.remote_addr)
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            controller.release(ticket)
+            raise
+
+        # a response may be closed more than once, its slot is released the first time
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                controller.release(ticket)
+
+        response.call_on_close(release)
+        return response
+
+    return wrapper
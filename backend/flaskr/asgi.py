@@ -0,0 +1,564 @@
+'''
+ASGI entry point
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+Serves the quiz, search and category listing routes natively on the event loop with an
+async database driver (asyncpg for PostgreSQL, aiosqlite for SQLite), so that players
+waiting on the database do not hold a worker thread each. Every other request, and every
+request a native route does not handle itself (invalid input, streaming, fulltext search,
+errors), runs through the Flask application on a thread pool, so the responses and error
+handlers are the ones of create_app. The native routes send the same ETag, Cache-Control,
+Vary and Content-Encoding headers as the Flask routes and answer If-None-Match with 304.
+Requests which the Flask routes serve from the question snapshot, and with the shared
+response cache the search and category listing requests, are passed on to them as well.
+'''
+import asyncio
+import collections.abc
+import concurrent.futures
+import hashlib
+import io
+import json
+import re
+import sys
+import time
+from urllib.parse import parse_qs
+
+from sqlalchemy.engine.url import make_url
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from flaskr import MAX_QUIZ_QUESTIONS, QUESTIONS_PER_PAGE, create_app
+from flaskr.compression import compress_body, get_compression_encodings
+from flaskr.quiz import draw_questions, get_difficulty_weights, get_question_index
+from flaskr.serialization import QUESTION_FIELDS, format_question_rows, load_json_encoder
+from flaskr.snapshot import get_snapshot
+from models import is_memory_database, sqlite_lower
+
+QUESTION_COLUMNS_SQL = ', '.join(QUESTION_FIELDS)
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization'),
+    (b'access-control-allow-methods', b'GET, POST, PATCH, DELETE, OPTIONS')
+]
+
+
+class NotHandled(Exception):
+    '''
+    Raised by a native route to pass the request on to the Flask application.
+    '''
+
+
+'''
+PostgresDatabase
+    an asyncpg connection pool. Queries use ? placeholders, which are numbered for asyncpg.
+'''
+
+
+class PostgresDatabase:
+    def __init__(self, url, min_size=1, max_size=10, statement_timeout=0):
+        self.url = re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql://', url)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_timeout = statement_timeout
+        self.pool = None
+
+    async def connect(self):
+        import asyncpg
+
+        server_settings = {'statement_timeout': str(self.statement_timeout)} if self.statement_timeout else None
+        self.pool = await asyncpg.create_pool(self.url, min_size=self.min_size, max_size=self.max_size, server_settings=server_settings)
+
+    async def close(self):
+        await self.pool.close()
+
+    async def fetch(self, sql, *parameters):
+        return await self.pool.fetch(number_placeholders(sql), *parameters)
+
+    def like_clause(self, column, search_term):
+        return f'{column} ILIKE ?'
+
+
+def number_placeholders(sql):
+    counter = iter(range(1, sql.count('?') + 1))
+    return re.sub(r'\?', lambda match: f'${next(counter)}', sql)
+
+
+'''
+SQLiteDatabase
+    an aiosqlite connection, which runs its queries on a thread of its own
+'''
+
+
+class SQLiteDatabase:
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    async def connect(self):
+        import aiosqlite
+
+        self.connection = await aiosqlite.connect(self.path)
+        await self.connection.create_function('lower', 1, sqlite_lower, deterministic=True)
+
+    async def close(self):
+        await self.connection.close()
+
+    async def fetch(self, sql, *parameters):
+        async with self.connection.execute(sql, parameters) as cursor:
+            return await cursor.fetchall()
+
+    def like_clause(self, column, search_term):
+        # LIKE is case-insensitive for ASCII on SQLite, see search_questions_query
+        if search_term.isascii():
+            return f'{column} LIKE ?'
+        return f'lower({column}) LIKE lower(?)'
+
+
+'''
+create_async_database(config)
+    returns the async database of the read replica if configured, otherwise of the primary database.
+    Returns None for a :memory: database, which only the connection of the Flask application sees.
+'''
+
+
+def create_async_database(config):
+    database_uri = config.get('DATABASE_REPLICA_URL') or config['SQLALCHEMY_DATABASE_URI']
+    if is_memory_database(database_uri):
+        return None
+
+    url = make_url(database_uri)
+    backend = url.get_backend_name()
+
+    if backend == 'postgresql':
+        return PostgresDatabase(
+            database_uri,
+            max_size=config.get('DATABASE_POOL_SIZE', 5) + config.get('DATABASE_MAX_OVERFLOW', 10),
+            statement_timeout=config.get('DATABASE_STATEMENT_TIMEOUT', 0)
+        )
+    if backend == 'sqlite':
+        return SQLiteDatabase(url.database or ':memory:')
+
+    raise ValueError(f'No async database driver for {backend}')
+
+
+'''
+AsyncRequest
+    the method, path, query arguments and body of a native route request
+'''
+
+
+class AsyncRequest:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {key: values[0] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.body = body
+
+    def get_json(self):
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            raise NotHandled()
+
+
+'''
+AsyncTriviaApp
+    the ASGI application, see the module docstring
+'''
+
+
+class AsyncTriviaApp:
+    def __init__(self, flask_app, database, threads=8):
+        self.flask_app = flask_app
+        self.database = database
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.dumps = load_json_encoder(flask_app.config.get('JSON_ENCODER', 'auto'))
+        self.connected = False
+        self.connect_lock = None
+        self.index_lock = None
+        self.admission = flask_app.extensions.get('admission')
+        self.compression_cache = flask_app.extensions.get('compression_cache')
+        self.compression_encodings = get_compression_encodings(flask_app.config) if self.compression_cache is not None else []
+        self.compression_min_size = flask_app.config.get('COMPRESSION_MIN_SIZE', 1024)
+
+        # shared with the Flask routes, whose writes keep it current
+        with flask_app.app_context():
+            self.question_index = get_question_index()
+
+        # without a database of its own every request is passed on to the Flask application.
+        # The last value of a route tells whether its responses carry an ETag.
+        self.routes = [] if database is None else [
+            ('POST', re.compile(r'^/api/v1/quizzes$'), '/api/v1/quizzes', self.play_quiz, False)
+        ]
+        # the responses in the shared response cache are served by the Flask routes
+        if database is not None and flask_app.extensions.get('response_cache') is None:
+            self.routes += [
+                ('POST', re.compile(r'^/api/v1/questions/searches$'), '/api/v1/questions/searches', self.search_questions, False),
+                ('GET', re.compile(r'^/api/v1/categories/(\d+)/questions$'), '/api/v1/categories/<int:category_id>/questions', self.get_category_questions, True)
+            ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported ASGI scope type: {scope["type"]}')
+
+        body = await read_body(receive)
+
+        for method, pattern, rule, handler, conditional in self.routes:
+            match = pattern.match(scope['path'])
+            if match is None or method != scope['method']:
+                continue
+
+            # the request is admitted once, also when it is passed on to the Flask route
+            try:
+                ticket = await self.admit(handler.__name__, scope)
+            except HTTPException as error:
+                # the same body as the error handlers of the Flask application
+                error_body = {'success': False, 'error': error.code, 'message': error.name.capitalize()}
+                return await self.send_json(send, error_body, error.code, [(b'retry-after', str(error.retry_after).encode('ascii'))])
+
+            try:
+                started_at = time.perf_counter()
+                try:
+                    await self.connect()
+                    response_body = await handler(AsyncRequest(scope, body), *match.groups())
+                except NotHandled:
+                    return await self.call_flask(scope, body, send, admitted=True)
+                except Exception:
+                    # the Flask route reports the error with its own error handlers
+                    self.flask_app.logger.exception('Native route %s failed, passing the request on', rule)
+                    return await self.call_flask(scope, body, send, admitted=True)
+
+                status = await self.send_json(send, response_body, request_headers=scope['headers'], conditional=conditional)
+                self.record_metrics(rule, method, status, time.perf_counter() - started_at)
+                return
+            finally:
+                if ticket is not None:
+                    self.admission.release(ticket)
+
+        await self.call_flask(scope, body, send)
+
+    async def admit(self, route, scope):
+        if self.admission is None or not self.admission.is_limited(route):
+            return None
+
+        client = scope['client'][0] if scope.get('client') else ''
+        # redis is called on the thread pool, to not block the event loop
+        if self.admission.backend.blocking:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.admission.admit, route, client)
+        return self.admission.admit(route, client)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.connect()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def connect(self):
+        if self.connected or self.database is None:
+            return
+
+        if self.connect_lock is None:
+            self.connect_lock = asyncio.Lock()
+        async with self.connect_lock:
+            if not self.connected:
+                await self.database.connect()
+                self.connected = True
+
+    async def close(self):
+        if self.connected:
+            await self.database.close()
+            self.connected = False
+        self.executor.shutdown(wait=False)
+
+    async def send_json(self, send, response_body, status=200, headers=(), request_headers=(), conditional=False):
+        '''
+        Sends the JSON response like the Flask application: with conditional a strong ETag of
+        the body, answering a matching If-None-Match with 304, and compressed with the best
+        encoding the client accepts. Returns the status sent.
+        '''
+        data = self.dumps(response_body)
+        headers = CORS_HEADERS + list(headers)
+        request_headers = {name.lower(): value.decode('latin-1') for name, value in request_headers}
+
+        if self.compression_encodings:
+            headers.append((b'vary', b'Accept-Encoding'))
+
+        etag = None
+        if conditional:
+            etag = hashlib.sha1(data).hexdigest()
+            headers.append((b'cache-control', b'no-cache'))
+            if parse_etags(request_headers.get(b'if-none-match')).contains_weak(etag):
+                await send({'type': 'http.response.start', 'status': 304, 'headers': headers + [(b'etag', quote_etag(etag).encode('ascii'))]})
+                await send({'type': 'http.response.body', 'body': b''})
+                return 304
+
+        encoding = None
+        if status == 200 and self.compression_encodings and len(data) >= self.compression_min_size:
+            encoding = parse_accept_header(request_headers.get(b'accept-encoding')).best_match(self.compression_encodings)
+        if encoding is not None:
+            # compressing large bodies would hold up the event loop
+            data = await asyncio.get_running_loop().run_in_executor(self.executor, compress_body, self.compression_cache, encoding, data, etag)
+            headers.append((b'content-encoding', encoding.encode('ascii')))
+        if etag is not None:
+            # compressed bodies carry the weak form of the ETag, see init_compression
+            headers.append((b'etag', quote_etag(etag, weak=encoding is not None).encode('ascii')))
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(data)).encode('ascii'))
+            ] + headers
+        })
+        await send({'type': 'http.response.body', 'body': data})
+        return status
+
+    def record_metrics(self, rule, method, status, duration):
+        metrics = self.flask_app.extensions['metrics'].metrics
+        metrics['trivia_request_duration_seconds'].observe({'route': rule, 'method': method, 'status': str(status)}, duration)
+
+    def has_snapshot(self):
+        # requests served from the question snapshot do not wait on the database
+        with self.flask_app.app_context():
+            return get_snapshot() is not None
+
+    async def call_flask(self, scope, body, send, admitted=False):
+        '''
+        Runs the Flask application on the thread pool, streaming its response chunks back to the event loop.
+        A request admitted by the admission control is not admitted again.
+        '''
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, body)
+        environ['trivia.admitted'] = admitted
+        response = {}
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            return lambda data: None
+
+        def run():
+            chunks = self.flask_app(environ, start_response)
+            try:
+                started = False
+                for chunk in chunks:
+                    if not started:
+                        send_from_thread({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                        started = True
+                    if chunk:
+                        send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+                if not started:
+                    send_from_thread({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                send_from_thread({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+
+        await loop.run_in_executor(self.executor, run)
+
+    async def get_question_index(self):
+        if self.question_index.is_stale():
+            if self.index_lock is None:
+                self.index_lock = asyncio.Lock()
+            async with self.index_lock:
+                if self.question_index.is_stale():
+                    self.question_index.load(await self.database.fetch('SELECT id, category, difficulty FROM questions'))
+        return self.question_index
+
+    # native routes, see the routes of the same name in create_app
+
+    async def play_quiz(self, request):
+        request_body = request.get_json()
+
+        if not isinstance(request_body, dict) or not isinstance(request_body.get('previous_questions'), collections.abc.Iterable):
+            raise NotHandled()
+
+        quiz_category = None
+        try:
+            if request_body.get('quiz_category') is not None:
+                quiz_category = request_body['quiz_category']['id']
+            exclude = set(request_body['previous_questions'])
+            difficulty_weights = get_difficulty_weights(request_body)
+        except (KeyError, TypeError, ValueError):
+            raise NotHandled()
+
+        # invalid counts are answered by the Flask application
+        count = request_body.get('count')
+        if count is not None and (not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_QUIZ_QUESTIONS):
+            raise NotHandled()
+
+        if self.has_snapshot():
+            raise NotHandled()
+
+        index = await self.get_question_index()
+        questions = []
+        while len(questions) < (count or 1):
+            with self.flask_app.app_context():
+                question_ids = draw_questions(index, (count or 1) - len(questions), quiz_category, exclude, difficulty_weights)
+            if len(question_ids) == 0:
+                break
+
+            placeholders = ', '.join('?' * len(question_ids))
+            rows = {row[0]: row for row in await self.database.fetch(f'SELECT {QUESTION_COLUMNS_SQL} FROM questions WHERE id IN ({placeholders})', *question_ids)}
+            for question_id in question_ids:
+                if question_id in rows:
+                    questions.append(rows[question_id])
+                else:
+                    # the question was deleted by another process; drop it and draw again
+                    index.remove(question_id)
+
+        if count is None:
+            return {'success': True, 'question': format_question_rows(questions)[0] if len(questions) > 0 else None}
+        return {'success': True, 'questions': format_question_rows(questions)}
+
+    async def search_questions(self, request):
+        request_body = request.get_json() or {}
+        if not isinstance(request_body, dict):
+            raise NotHandled()
+
+        search_term = request_body.get('search_term', '')
+        mode = request_body.get('mode', self.flask_app.config['SEARCH_MODE'])
+
+        # fulltext search and streaming run in the Flask application
+        if mode != 'substring' or not isinstance(search_term, str) or request.args.get('stream') == 'true' or self.has_snapshot():
+            raise NotHandled()
+
+        questions, total_questions = await self.fetch_questions(
+            self.database.like_clause('question', search_term), [f'%{search_term}%'], get_pagination(request.args)
+        )
+
+        return {
+            'success': True,
+            'questions': format_question_rows(questions),
+            'total_questions': total_questions,
+            'current_category': None
+        }
+
+    async def get_category_questions(self, request, category_id):
+        if request.args.get('stream') == 'true' or self.has_snapshot():
+            raise NotHandled()
+
+        pagination = get_pagination(request.args)
+        categories = await self.database.fetch('SELECT id, type FROM categories WHERE id = ?', int(category_id))
+        if len(categories) == 0:
+            raise NotHandled()
+
+        category_id, category_type = categories[0]
+        questions, total_questions = await self.fetch_questions(
+            'category = ?', [category_id], pagination,
+            count_sql='SELECT coalesce(sum(count), 0) FROM question_counts WHERE category_id = ?'
+        )
+
+        return {
+            'success': True,
+            'questions': format_question_rows(questions),
+            'total_questions': total_questions,
+            'current_category': {'id': category_id, 'type': category_type}
+        }
+
+    async def fetch_questions(self, condition, parameters, pagination, count_sql=None):
+        sql = f'SELECT {QUESTION_COLUMNS_SQL} FROM questions WHERE {condition} ORDER BY id'
+        if pagination is None:
+            questions = await self.database.fetch(sql, *parameters)
+            return questions, len(questions)
+
+        page, per_page = pagination
+        questions, counts = await asyncio.gather(
+            self.database.fetch(sql + ' LIMIT ? OFFSET ?', *parameters, per_page, (page - 1) * per_page),
+            self.database.fetch(count_sql or f'SELECT count(*) FROM questions WHERE {condition}', *parameters)
+        )
+        return questions, counts[0][0]
+
+
+'''
+get_pagination(args)
+    returns the (page, per_page) arguments like get_pagination in create_app, raises NotHandled for invalid ones
+'''
+
+
+def get_pagination(args):
+    if 'page' not in args and 'per_page' not in args:
+        return None
+
+    try:
+        page = int(args.get('page', 1))
+        per_page = int(args.get('per_page', QUESTIONS_PER_PAGE))
+    except ValueError:
+        raise NotHandled()
+
+    if page < 1 or per_page < 1 or per_page > 100:
+        raise NotHandled()
+
+    return page, per_page
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def build_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name not in ('content-length', 'transfer-encoding'):
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = environ[key] + ',' + value if key in environ else value
+
+    # the body has been read completely, also when it was sent chunked without a Content-Length
+    environ['CONTENT_LENGTH'] = str(len(body))
+
+    return environ
+
+
+'''
+create_asgi_app(test_config)
+    creates the Flask application with create_app and wraps it in the ASGI application
+'''
+
+
+def create_asgi_app(test_config=None):
+    flask_app = create_app(test_config)
+    return AsyncTriviaApp(
+        flask_app,
+        create_async_database(flask_app.config),
+        threads=flask_app.config.get('ASGI_THREADS', 8)
+    )
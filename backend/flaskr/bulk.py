@@ -0,0 +1,263 @@
+import csv
+import io
+import json
+
+from flask import current_app, json as flask_json
+
+from models import db, change_question_counts, record_new_questions, record_question_changes, Question
+from flaskr.cache import invalidate_question_count_cache
+from flaskr.response_cache import QUESTIONS_SCOPE, bump_response_cache, get_category_scope
+from flaskr.snapshot import mark_snapshot_dirty
+
+REQUIRED_QUESTION_FIELDS = ['question', 'answer', 'difficulty', 'category']
+EXPORT_FIELDS = ['id', 'question', 'answer', 'category', 'difficulty']
+IMPORT_FORMATS = {
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'text/csv': 'csv'
+}
+MAX_REPORTED_ERRORS = 100
+
+'''
+validate_question_data(data)
+    returns the name of the first required field which is missing or empty, or None
+'''
+
+
+def validate_question_data(data):
+    for key in REQUIRED_QUESTION_FIELDS:
+        # all required request data must exist
+        if key not in data or data[key] is None or data[key] == '':
+            return key
+    return None
+
+
+'''
+read_questions(stream, format, category_ids)
+    yields a (line number, question row or error message) pair for every
+    record of an NDJSON or CSV stream, whose category must be one of category_ids
+'''
+
+
+def read_questions(stream, format, category_ids):
+    if format == 'ndjson':
+        records = read_ndjson(stream)
+    elif format == 'csv':
+        records = read_csv(stream)
+    else:
+        raise ValueError(f'Unknown import format: {format}')
+
+    for line_number, record in records:
+        if isinstance(record, str):
+            yield line_number, record
+            continue
+
+        if not isinstance(record, dict):
+            yield line_number, 'record must be an object'
+            continue
+
+        missing_key = validate_question_data(record)
+        if missing_key is not None:
+            yield line_number, f'{missing_key} is required'
+            continue
+
+        try:
+            difficulty = int(record['difficulty'])
+        except (TypeError, ValueError):
+            yield line_number, 'difficulty must be an integer'
+            continue
+
+        try:
+            category = int(record['category'])
+        except (TypeError, ValueError):
+            yield line_number, 'category must be an integer'
+            continue
+
+        if category not in category_ids:
+            yield line_number, 'category does not exist'
+            continue
+
+        yield line_number, {
+            'question': str(record['question']),
+            'answer': str(record['answer']),
+            'category': category,
+            'difficulty': difficulty
+        }
+
+
+def read_ndjson(stream):
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip() == '':
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, 'invalid JSON'
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+
+'''
+import_questions(records, batch_size, progress)
+    inserts the valid question rows in batches of batch_size, one transaction per batch,
+    and returns the number of imported rows and the errors of the invalid ones.
+    progress, if given, is called with the number of imported rows after every batch.
+'''
+
+
+def import_questions(records, batch_size=1000, progress=None):
+    imported = 0
+    categories = set()
+    errors = []
+    error_count = 0
+    batch = []
+
+    def flush():
+        nonlocal imported
+        insert_batch(batch)
+        imported += len(batch)
+        batch.clear()
+        if progress is not None:
+            progress(imported)
+
+    try:
+        for line_number, record in records:
+            if isinstance(record, str):
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': line_number, 'message': record})
+                continue
+
+            batch.append(record)
+            categories.add(record['category'])
+            if len(batch) >= batch_size:
+                flush()
+
+        if len(batch) > 0:
+            flush()
+    finally:
+        # rows were inserted around the ORM, so the in-process question indexes are rebuilt
+        if imported > 0:
+            invalidate_question_caches(categories)
+
+    return imported, error_count, errors
+
+
+def insert_batch(rows):
+    try:
+        # the questions above the largest id so far are the ones of this batch
+        connection = db.session.connection()
+        last_id = connection.execute(db.select([db.func.coalesce(db.func.max(Question.id), 0)])).scalar()
+
+        if db.engine.dialect.name == 'postgresql':
+            copy_batch(rows)
+        else:
+            db.session.execute(Question.__table__.insert(), rows)
+
+        category_changes = {}
+        for row in rows:
+            category_changes[row['category']] = category_changes.get(row['category'], 0) + 1
+        change_question_counts(connection, category_changes)
+        record_new_questions(connection, last_id)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def copy_batch(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row['question'], row['answer'], row['category'], row['difficulty']])
+    buffer.seek(0)
+
+    # COPY runs on the connection of the session, inside its transaction
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert('COPY questions (question, answer, category, difficulty) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def invalidate_question_caches(categories):
+    for name in ('question_index', 'search_index', 'question_count_cache'):
+        extension = current_app.extensions.get(name)
+        if extension is not None:
+            extension.invalidate()
+
+    mark_snapshot_dirty()
+    bump_response_cache({QUESTIONS_SCOPE} | {get_category_scope(category) for category in categories})
+
+
+'''
+delete_questions(question_ids)
+    deletes the questions with the given ids in one transaction, with one statement
+    locking and one deleting them, and returns the ids of the deleted questions
+'''
+
+
+def delete_questions(question_ids):
+    try:
+        rows = db.session.query(Question.id, Question.category).filter(Question.id.in_(question_ids)).with_for_update().all()
+        deleted_ids = [question_id for question_id, _ in rows]
+
+        category_changes = {}
+        for _, category in rows:
+            category_changes[category] = category_changes.get(category, 0) - 1
+
+        if len(deleted_ids) > 0:
+            db.session.query(Question).filter(Question.id.in_(deleted_ids)).delete(synchronize_session=False)
+            change_question_counts(db.session.connection(), category_changes)
+            record_question_changes(db.session.connection(), deleted_ids, deleted=True)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # rows were deleted around the ORM, so the in-process indexes are updated here
+    for name in ('question_index', 'search_index'):
+        extension = current_app.extensions.get(name)
+        if extension is not None:
+            for question_id in deleted_ids:
+                extension.remove(question_id)
+    if len(deleted_ids) > 0:
+        invalidate_question_count_cache()
+        mark_snapshot_dirty()
+        bump_response_cache({QUESTIONS_SCOPE} | {get_category_scope(category) for category in category_changes})
+
+    return deleted_ids
+
+
+'''
+export_questions(format, batch_size)
+    yields the questions table as NDJSON lines or CSV rows, reading it in batches
+    of batch_size column tuples through a server-side cursor
+'''
+
+
+def export_questions(format, batch_size=1000):
+    rows = db.session.query(
+        Question.id, Question.question, Question.answer, Question.category, Question.difficulty
+    ).order_by(Question.id).execution_options(stream_results=True).yield_per(batch_size)
+
+    if format == 'ndjson':
+        for row in rows:
+            yield flask_json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+    elif format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        raise ValueError(f'Unknown export format: {format}')
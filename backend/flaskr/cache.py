@@ -0,0 +1,175 @@
+import hashlib
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import get_question_count, Category, Question
+from flaskr.serialization import dumps
+
+'''
+CachedCategories
+    the categories as an id to type mapping, together with the serialized
+    get_categories response body and its strong ETag
+'''
+
+
+class CachedCategories:
+    def __init__(self, categories):
+        self.categories = categories
+        self.body = dumps({
+            'success': True,
+            'categories': categories
+        })
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+
+'''
+CategoryCache
+    caches the categories until a category is inserted, updated or deleted,
+    or until ttl seconds have passed so that writes made by other processes show up.
+    The categories and the time they were cached at are kept in one tuple, so that a
+    concurrent invalidation never leaves a reader with half of them, and a fill started
+    before an invalidation is not stored, as it may have read the categories before the write.
+'''
+
+
+class CategoryCache:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entry = None
+        self.generation = 0
+
+    def get(self):
+        entry = self.entry
+        if entry is not None and (self.ttl is None or time.monotonic() - entry[1] <= self.ttl):
+            return entry[0]
+
+        generation = self.generation
+        categories = {}
+        for category_id, category_type in Category.query.with_entities(Category.id, Category.type).order_by(Category.id):
+            categories[category_id] = category_type
+
+        cached = CachedCategories(categories)
+        with self.lock:
+            if self.generation == generation:
+                self.entry = (cached, time.monotonic())
+
+        return cached
+
+    def invalidate(self):
+        with self.lock:
+            self.entry = None
+            self.generation += 1
+
+
+'''
+QuestionCountCache
+    caches the total number of questions, summed up from the per-category question counts.
+    Like CategoryCache it keeps the count with the time it was counted at in one tuple and
+    drops counts which started before an invalidation.
+'''
+
+
+class QuestionCountCache:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entry = None
+        self.generation = 0
+
+    def get(self):
+        entry = self.entry
+        if entry is not None and (self.ttl is None or time.monotonic() - entry[1] <= self.ttl):
+            return entry[0]
+
+        generation = self.generation
+        count = get_question_count()
+        with self.lock:
+            if self.generation == generation:
+                self.entry = (count, time.monotonic())
+
+        return count
+
+    def invalidate(self):
+        with self.lock:
+            self.entry = None
+            self.generation += 1
+
+
+'''
+get_category_cache()
+    returns the category cache bound to the current application
+'''
+
+
+def get_category_cache():
+    cache = current_app.extensions.get('category_cache')
+    if cache is None:
+        cache = CategoryCache(ttl=current_app.config.get('CATEGORY_CACHE_TTL', 300))
+        current_app.extensions['category_cache'] = cache
+    return cache
+
+
+def invalidate_category_cache():
+    if has_app_context() and 'category_cache' in current_app.extensions:
+        current_app.extensions['category_cache'].invalidate()
+
+
+'''
+get_question_count_cache()
+    returns the question count cache bound to the current application
+'''
+
+
+def get_question_count_cache():
+    cache = current_app.extensions.get('question_count_cache')
+    if cache is None:
+        cache = QuestionCountCache(ttl=current_app.config.get('QUESTION_COUNT_CACHE_TTL', 60))
+        current_app.extensions['question_count_cache'] = cache
+    return cache
+
+
+def invalidate_question_count_cache():
+    if has_app_context() and 'question_count_cache' in current_app.extensions:
+        current_app.extensions['question_count_cache'].invalidate()
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def on_category_change(mapper, connection, category):
+    invalidate_category_cache()
+
+    # invalidate once more on commit, in case the cache was refilled
+    # from another session before the change became visible
+    session = object_session(category)
+    if session is not None:
+        session.info['categories_changed'] = True
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_delete')
+def on_question_count_change(mapper, connection, question):
+    invalidate_question_count_cache()
+
+    session = object_session(question)
+    if session is not None:
+        session.info['question_count_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def on_commit(session):
+    if session.info.pop('categories_changed', False):
+        invalidate_category_cache()
+    if session.info.pop('question_count_changed', False):
+        invalidate_question_count_cache()
+
+
+@event.listens_for(Session, 'after_rollback')
+def on_rollback(session):
+    session.info.pop('categories_changed', None)
+    session.info.pop('question_count_changed', None)
@@ -0,0 +1,30 @@
+from models import db, Question, QuestionChange
+from flaskr.serialization import QUESTION_COLUMNS
+
+'''
+get_question_changes(since, limit)
+    returns the rows of the questions changed after the version since and the ids of the
+    questions deleted after it, from at most limit changes in the order of their versions,
+    with the version of the last of these changes (or since when there are none) and
+    whether there are more changes after it
+'''
+
+
+def get_question_changes(since, limit):
+    # a question missing from the join was deleted, even if its tombstone is not committed yet
+    changes = db.session.query(QuestionChange.version, QuestionChange.question_id, *QUESTION_COLUMNS) \
+        .outerjoin(Question, Question.id == QuestionChange.question_id) \
+        .filter(QuestionChange.version > since) \
+        .order_by(QuestionChange.version) \
+        .limit(limit + 1) \
+        .all()
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    questions = [change[2:] for change in changes if change[2] is not None]
+    deleted_ids = [change[1] for change in changes if change[2] is None]
+    version = changes[-1][0] if len(changes) > 0 else since
+
+    return questions, deleted_ids, version, has_more
+
@@ -0,0 +1,154 @@
+import collections
+import gzip
+import threading
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+GZIP_LEVEL = 6
+# higher brotli qualities compress only slightly better at many times the cost
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+'''
+Compressors
+    functions compressing a response body for a Content-Encoding, in the order
+    they are preferred when a client accepts several of them with the same quality
+'''
+
+COMPRESSORS = collections.OrderedDict()
+
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+
+if zstandard is not None:
+    COMPRESSORS['zstd'] = lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+COMPRESSORS['gzip'] = lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+'''
+CompressedCache
+    keeps the compressed bodies of responses with an ETag, keyed by (ETag, encoding),
+    evicting the least recently used ones beyond max_bytes
+'''
+
+
+class CompressedCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+'''
+get_compression_encodings(config)
+    returns the encodings of COMPRESSION_ENCODINGS which have a compressor, in the order given
+'''
+
+
+def get_compression_encodings(config):
+    return [
+        encoding.strip()
+        for encoding in config.get('COMPRESSION_ENCODINGS', ','.join(COMPRESSORS)).split(',')
+        if encoding.strip() in COMPRESSORS
+    ]
+
+
+'''
+compress_body(cache, encoding, data, etag)
+    returns the data compressed with the encoding, taken from the cache for responses with an ETag
+'''
+
+
+def compress_body(cache, encoding, data, etag=None):
+    compressed = cache.get((etag, encoding)) if etag is not None else None
+    if compressed is None:
+        compressed = COMPRESSORS[encoding](data)
+        if etag is not None:
+            cache.put((etag, encoding), compressed)
+    return compressed
+
+
+'''
+init_compression(app)
+    compresses JSON, NDJSON, CSV and text responses of at least COMPRESSION_MIN_SIZE bytes
+    with the best encoding of COMPRESSION_ENCODINGS the client accepts. Streamed responses
+    are sent uncompressed.
+'''
+
+
+def init_compression(app):
+    cache = CompressedCache(app.config.get('COMPRESSION_CACHE_BYTES', 16 * 1024 * 1024))
+    app.extensions['compression_cache'] = cache
+
+    min_size = app.config.get('COMPRESSION_MIN_SIZE', 1024)
+    encodings = get_compression_encodings(app.config)
+
+    @app.after_request
+    def compress_response(response):
+        if len(encodings) == 0 or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+            return response
+
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        etag, is_weak = response.get_etag()
+        response.set_data(compress_body(cache, encoding, data, etag))
+        response.headers['Content-Encoding'] = encoding
+
+        # the compressed body is a different representation, but If-None-Match
+        # compares weakly, so the weak ETag still revalidates against the plain one
+        if etag is not None and not is_weak:
+            response.set_etag(etag, weak=True)
+
+        return response
+
+    return cache
@@ -0,0 +1,91 @@
+import re
+
+from models import db, reconcile_question_counts, record_new_questions
+
+COPY_PATTERN = re.compile(r'^COPY (?:\w+\.)?(\w+) \(([^)]*)\) FROM stdin;$')
+COPY_ESCAPE_PATTERN = re.compile(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)')
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+'''
+read_copy_blocks(stream)
+    yields the (table, columns, rows) of the COPY blocks of a pg_dump file like trivia.psql,
+    with the values as strings or None. All other statements of the dump are skipped.
+'''
+
+
+def read_copy_blocks(stream):
+    lines = iter(stream)
+    for line in lines:
+        match = COPY_PATTERN.match(line.rstrip('\r\n'))
+        if match is None:
+            continue
+
+        columns = [column.strip().strip('"') for column in match.group(2).split(',')]
+        rows = []
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if line == '\\.':
+                break
+            rows.append([decode_copy_value(value) for value in line.split('\t')])
+
+        yield match.group(1), columns, rows
+
+
+def decode_copy_value(value):
+    if value == '\\N':
+        return None
+    if '\\' not in value:
+        return value
+
+    return COPY_ESCAPE_PATTERN.sub(decode_copy_escape, value)
+
+
+def decode_copy_escape(match):
+    escape = match.group(1)
+    if escape[0] == 'x' and len(escape) > 1:
+        return chr(int(escape[1:], 16))
+    if escape[0].isdigit():
+        return chr(int(escape, 8))
+    return COPY_ESCAPES.get(escape, escape)
+
+
+'''
+load_fixture(path)
+    inserts the rows of the model tables in a pg_dump file into the database, on any backend,
+    keeping their ids and recording the questions as changed. The question counts are
+    recounted afterwards. Returns the number of rows inserted per table.
+'''
+
+
+def load_fixture(path):
+    tables = db.Model.metadata.tables
+    inserted = {}
+
+    with open(path, encoding='utf-8') as stream:
+        for table_name, columns, rows in read_copy_blocks(stream):
+            # the question counts are derived from the questions
+            if table_name not in tables or table_name == 'question_counts':
+                continue
+
+            table = tables[table_name]
+            fields = [(index, column, table.c[column].type.python_type) for index, column in enumerate(columns) if column in table.c]
+            values = [
+                {column: convert(row[index]) if row[index] is not None else None for index, column, convert in fields}
+                for row in rows
+            ]
+            if len(values) > 0:
+                db.session.execute(table.insert(), values)
+            inserted[table_name] = len(values)
+
+    if 'questions' in inserted:
+        record_new_questions(db.session.connection())
+
+    # the sequences do not advance for explicit ids
+    if db.engine.dialect.name == 'postgresql':
+        for table_name in inserted:
+            db.session.execute(f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), coalesce(max(id), 1)) FROM {table_name}")
+
+    db.session.commit()
+    reconcile_question_counts()
+
+    return inserted
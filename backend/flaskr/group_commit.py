@@ -0,0 +1,151 @@
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+import time
+
+from models import db, Question
+
+logger = logging.getLogger(__name__)
+
+'''
+Write operations of the group commits
+    apply() runs within the transaction of a batch and returns the result of the operation,
+    which is read once the batch is flushed
+'''
+
+
+class InsertQuestion:
+    def __init__(self, question, answer, category, difficulty):
+        self.question = Question(question, answer, category, difficulty)
+
+    def apply(self, session, deleted_ids):
+        session.add(self.question)
+        # the id is read after the flush of the batch
+        return lambda: self.question.id
+
+
+class DeleteQuestion:
+    def __init__(self, question_id):
+        self.question_id = question_id
+
+    def apply(self, session, deleted_ids):
+        # a question deleted twice within a batch is only deleted by the first request
+        if self.question_id in deleted_ids:
+            return lambda: False
+
+        question = session.query(Question).get(self.question_id)
+        if question is None:
+            return lambda: False
+
+        session.delete(question)
+        deleted_ids.add(self.question_id)
+        return lambda: True
+
+
+'''
+GroupCommitter
+    collects the write operations of concurrent requests and commits them in one transaction
+    per batch, on a writer thread with an app context of its own. A batch is committed once it
+    has max_batch_size operations or max_latency seconds after its first one, whichever comes
+    first. submit() returns once the batch of its operation is committed, so a response is only
+    sent for a durable write. When a batch fails its operations are committed one by one, so
+    that an invalid operation only fails its own request.
+'''
+
+
+class GroupCommitter:
+    def __init__(self, app, max_batch_size=100, max_latency=0.005):
+        self.app = app
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.writer = None
+        self.writer_pid = None
+        self.batches = 0
+        self.operations = 0
+
+    def submit(self, operation):
+        '''
+        Queues the operation, waits for the commit of its batch and returns its result.
+        Raises the exception of the operation if it could not be committed.
+        '''
+        self.ensure_started()
+        future = concurrent.futures.Future()
+        self.queue.put((operation, future))
+        return future.result()
+
+    def ensure_started(self):
+        # a forked worker does not inherit the writer thread of its parent
+        if self.writer is not None and self.writer_pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.writer is None or self.writer_pid != os.getpid():
+                self.queue = queue.Queue()
+                self.writer = threading.Thread(target=self.run, name='group-commit', daemon=True)
+                self.writer_pid = os.getpid()
+                self.writer.start()
+
+    def run(self):
+        write_queue = self.queue
+        while True:
+            batch = [write_queue.get()]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(write_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                with self.app.app_context():
+                    self.commit(batch)
+            except BaseException as error:
+                logger.exception('Group commit of %d operations failed', len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def commit(self, batch):
+        session = db.session
+        try:
+            deleted_ids = set()
+            results = [operation.apply(session, deleted_ids) for operation, _ in batch]
+            session.flush()
+            results = [result() for result in results]
+            session.commit()
+        except Exception as error:
+            session.rollback()
+            if len(batch) == 1:
+                batch[0][1].set_exception(error)
+                return
+
+            for operation in batch:
+                self.commit([operation])
+            return
+        finally:
+            session.remove()
+
+        self.batches += 1
+        self.operations += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+'''
+create_group_committer(app)
+    creates the group committer of the application when WRITE_BATCHING is enabled, or returns None
+'''
+
+
+def create_group_committer(app):
+    if not app.config.get('WRITE_BATCHING'):
+        return None
+
+    return GroupCommitter(app, app.config.get('WRITE_BATCH_SIZE', 100), app.config.get('WRITE_BATCH_LATENCY', 0.005))
@@ -0,0 +1,213 @@
+import bisect
+import threading
+import time
+
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+'''
+Counter
+    a monotonically increasing value per label set
+'''
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, labels, value=1):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(key), value) for key, value in sorted(self.values.items())]
+
+
+'''
+Histogram
+    counts observations per bucket and their sum, per label set
+'''
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, labels, value):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def get(self, labels):
+        counts, total = self.values.get(tuple(sorted(labels.items())), ([0] * (len(self.buckets) + 1), 0))
+        return sum(counts), total
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                labels = dict(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', dict(labels, le=format_bound(bound)), cumulative))
+                samples.append((self.name + '_sum', labels, total))
+                samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+def format_bound(bound):
+    if bound == float('inf'):
+        return '+Inf'
+    return repr(float(bound))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+'''
+MetricsRegistry
+    holds the metrics of one application and renders them in the Prometheus text format
+'''
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def counter(self, name, help):
+        return self._register(name, lambda: Counter(name, help))
+
+    def histogram(self, name, help, buckets):
+        return self._register(name, lambda: Histogram(name, help, buckets))
+
+    def _register(self, name, create):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = create()
+            return self.metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in sorted(self.metrics.values(), key=lambda metric: metric.name):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                label_text = ','.join(f'{key}="{escape_label(labels[key])}"' for key in sorted(labels))
+                lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+'''
+get_metrics()
+    returns the metrics registry bound to the current application
+'''
+
+
+def get_metrics():
+    return current_app.extensions['metrics']
+
+
+'''
+init_metrics(app)
+    records the latency, SQL statements and payload size of every request,
+    serves them on /metrics and, if METRICS_SERVER_TIMING is set, in Server-Timing headers
+'''
+
+
+def init_metrics(app):
+    registry = MetricsRegistry()
+    app.extensions['metrics'] = registry
+
+    request_duration = registry.histogram('trivia_request_duration_seconds', 'Request latency in seconds.', LATENCY_BUCKETS)
+    request_statements = registry.histogram('trivia_request_sql_statements', 'SQL statements per request.', STATEMENT_BUCKETS)
+    sql_statements = registry.counter('trivia_sql_statements_total', 'SQL statements executed.')
+    sql_duration = registry.counter('trivia_sql_duration_seconds_total', 'Time spent in SQL statements, in seconds.')
+    response_size = registry.histogram('trivia_response_size_bytes', 'Response payload size in bytes.', SIZE_BUCKETS)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_started_at = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_duration = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_started_at' not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_started_at
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        labels = {'route': route, 'method': request.method, 'status': str(response.status_code)}
+
+        request_duration.observe(labels, duration)
+        request_statements.observe({'route': route}, g.sql_statements)
+        sql_statements.inc({'route': route}, g.sql_statements)
+        sql_duration.inc({'route': route}, g.sql_duration)
+
+        # streamed responses have no length until they are sent
+        content_length = response.calculate_content_length()
+        if content_length is not None:
+            response_size.observe({'route': route}, content_length)
+
+        if app.config.get('METRICS_SERVER_TIMING'):
+            response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(
+                g.sql_duration * 1000,
+                g.sql_statements,
+                (duration - g.sql_duration) * 1000
+            ))
+
+        return response
+
+    @app.route('/metrics')
+    def get_metrics_text():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    return registry
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def on_before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('statement_started_at', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def on_after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    started_at = connection.info['statement_started_at'].pop()
+
+    if has_app_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_duration += time.perf_counter() - started_at
+
+
+@event.listens_for(Engine, 'handle_error')
+def on_handle_error(context):
+    started_at = context.connection.info.get('statement_started_at') if context.connection is not None else None
+    if started_at:
+        started_at.pop()
@@ -0,0 +1,55 @@
+import base64
+import binascii
+import json
+
+from flaskr.serialization import dumps, format_question_row
+
+'''
+encode_cursor(question_id)
+    returns an opaque cursor pointing after the given question id
+'''
+
+
+def encode_cursor(question_id):
+    payload = json.dumps({'id': question_id}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+'''
+decode_cursor(cursor)
+    returns the question id the cursor points after, raises ValueError for invalid cursors
+'''
+
+
+def decode_cursor(cursor):
+    try:
+        padded_cursor = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded_cursor.encode('ascii')))
+        question_id = payload['id']
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+        raise ValueError(f'Invalid cursor: {cursor}')
+
+    if not isinstance(question_id, int) or isinstance(question_id, bool):
+        raise ValueError(f'Invalid cursor: {cursor}')
+
+    return question_id
+
+
+'''
+stream_questions(body, rows)
+    yields the response body as JSON, serializing the question rows one at a time
+    and appending their number as total_questions
+'''
+
+
+def stream_questions(body, rows):
+    # the body without its closing brace, so the questions can be appended
+    head = dumps(body)[:-1]
+    yield head + (b',' if len(body) > 0 else b'') + b'"questions":['
+
+    total_questions = 0
+    for row in rows:
+        yield (b',' if total_questions > 0 else b'') + dumps(format_question_row(row))
+        total_questions += 1
+
+    yield b'],"total_questions":' + str(total_questions).encode('ascii') + b'}'
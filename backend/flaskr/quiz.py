@@ -0,0 +1,394 @@
+import bisect
+import math
+import random
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Question
+from flaskr.serialization import question_rows
+
+# the difficulties of the adaptive selection, from the easiest to the hardest
+DIFFICULTIES = (1, 2, 3, 4, 5)
+
+'''
+QuestionIndex
+    an in-process index of question ids, grouped by category and by (category, difficulty),
+    used to draw random quiz questions without loading the questions table. The buckets are
+    only read under the lock, since add and remove reorder them in place.
+'''
+
+
+class QuestionIndex:
+    ALL = None
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.built_at = None
+        self.buckets = {}
+        self.positions = {}
+        self.difficulties = {}
+
+    def is_stale(self):
+        return self.built_at is None or (self.ttl is not None and time.monotonic() - self.built_at > self.ttl)
+
+    def invalidate(self):
+        with self.lock:
+            self.built_at = None
+
+    def build(self):
+        # only the (id, category, difficulty) rows are loaded, never full question rows
+        self.load(db.session.query(Question.id, Question.category, Question.difficulty).all())
+
+    def load(self, rows):
+        with self.lock:
+            self.buckets = {}
+            self.positions = {}
+            self.difficulties = {}
+            for question_id, category, difficulty in rows:
+                self._add(question_id, category, difficulty)
+            self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self.is_stale():
+            self.build()
+
+    def add(self, question_id, category, difficulty=None):
+        with self.lock:
+            if self.built_at is not None:
+                self._add(question_id, category, difficulty)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.built_at is not None:
+                self._remove(question_id)
+
+    def ids(self, category=ALL):
+        self.ensure_built()
+        with self.lock:
+            return list(self.buckets.get(self._key(category), ()))
+
+    def sample(self, category=ALL, exclude=()):
+        '''
+        Returns a uniformly random id from the given category (or from all categories)
+        which is not in exclude, or None if every id has been excluded.
+        '''
+        self.ensure_built()
+        if not isinstance(exclude, (set, frozenset)):
+            exclude = set(exclude)
+
+        with self.lock:
+            return draw_from_bucket(self.buckets.get(self._key(category), ()), exclude)
+
+    def sample_weighted(self, weights, category=ALL, exclude=()):
+        '''
+        Returns a random id from the given category (or from all categories) which is not
+        in exclude, drawing its difficulty by the given {difficulty: weight} mapping among the
+        difficulties with questions left, or None if there are none left.
+        '''
+        self.ensure_built()
+        if not isinstance(exclude, (set, frozenset)):
+            exclude = set(exclude)
+
+        key = self._key(category)
+        with self.lock:
+            excluded = {}
+            for question_id in exclude:
+                difficulty = self.difficulties.get(question_id)
+                if (key, difficulty) in self.positions.get(question_id, ()):
+                    excluded[difficulty] = excluded.get(difficulty, 0) + 1
+
+            remaining = {difficulty: len(self.buckets.get((key, difficulty), ())) - excluded.get(difficulty, 0) for difficulty in weights}
+            difficulty = draw_difficulty(weights, remaining)
+            if difficulty is None:
+                return None
+
+            return draw_from_bucket(self.buckets[(key, difficulty)], exclude)
+
+    @staticmethod
+    def _key(category):
+        return None if category is None else str(category)
+
+    def _add(self, question_id, category, difficulty=None):
+        if question_id in self.positions:
+            self._remove(question_id)
+
+        positions = {}
+        for key in (self.ALL, self._key(category), (self.ALL, difficulty), (self._key(category), difficulty)):
+            bucket = self.buckets.setdefault(key, [])
+            positions[key] = len(bucket)
+            bucket.append(question_id)
+        self.positions[question_id] = positions
+        self.difficulties[question_id] = difficulty
+
+    def _remove(self, question_id):
+        positions = self.positions.pop(question_id, None)
+        if positions is None:
+            return
+
+        del self.difficulties[question_id]
+
+        # swap-remove keeps the per-bucket lists dense and removal constant-time
+        for key, position in positions.items():
+            bucket = self.buckets[key]
+            last_id = bucket.pop()
+            if last_id != question_id:
+                bucket[position] = last_id
+                self.positions[last_id][key] = position
+
+
+'''
+draw_from_bucket(ids, exclude)
+    returns a uniformly random id of the ids which is not in exclude, or None if every id has been excluded
+'''
+
+
+def draw_from_bucket(ids, exclude):
+    if len(ids) == 0:
+        return None
+
+    # rejection sampling: while at most half of the bucket is excluded
+    # the expected number of draws is at most two
+    if len(exclude) * 2 <= len(ids):
+        while True:
+            question_id = ids[random.randrange(len(ids))]
+            if question_id not in exclude:
+                return question_id
+
+    # the bucket is smaller than twice the exclude set, so filtering it
+    # is bounded by the size of the request itself
+    candidates = [question_id for question_id in ids if question_id not in exclude]
+    if len(candidates) == 0:
+        return None
+
+    return random.choice(candidates)
+
+
+'''
+draw_difficulty(weights, remaining)
+    returns a difficulty drawn by the {difficulty: weight} weights among the difficulties
+    with remaining questions, or None if there are none
+'''
+
+
+def draw_difficulty(weights, remaining):
+    # the cumulative weights of the difficulties with questions left, searched with bisect
+    difficulties = []
+    cumulative_weights = []
+    total_weight = 0
+    for difficulty, weight in sorted(weights.items()):
+        if weight > 0 and remaining.get(difficulty, 0) > 0:
+            total_weight += weight
+            difficulties.append(difficulty)
+            cumulative_weights.append(total_weight)
+
+    if len(difficulties) == 0:
+        return None
+
+    position = bisect.bisect_right(cumulative_weights, random.random() * total_weight)
+    return difficulties[min(position, len(difficulties) - 1)]
+
+
+'''
+get_question_index()
+    returns the question index bound to the current application
+'''
+
+
+def get_question_index():
+    index = current_app.extensions.get('question_index')
+    if index is None:
+        index = QuestionIndex(ttl=current_app.config.get('QUESTION_INDEX_TTL', 300))
+        current_app.extensions['question_index'] = index
+    return index
+
+
+'''
+get_adaptive_weights(correct_answers, total_answers, spread)
+    returns difficulty weights centered on a difficulty which rises with the share of correct
+    answers, from the easiest difficulty for none to the hardest for all. The share is smoothed,
+    so that a new player starts in the middle.
+'''
+
+
+def get_adaptive_weights(correct_answers, total_answers, spread=1.0):
+    share = (correct_answers + 1) / (total_answers + 2)
+    target = DIFFICULTIES[0] + share * (DIFFICULTIES[-1] - DIFFICULTIES[0])
+    return {difficulty: math.exp(-(difficulty - target) ** 2 / (2 * spread ** 2)) for difficulty in DIFFICULTIES}
+
+
+'''
+get_difficulty_weights(request_body)
+    returns the difficulty weights of a quiz request, given by its difficulty_weights mapping
+    or adapted to its {'correct', 'total'} answers, or None for a uniform draw.
+    Raises ValueError for invalid ones.
+'''
+
+
+def get_difficulty_weights(request_body):
+    weights = request_body.get('difficulty_weights')
+    answers = request_body.get('answers')
+
+    if weights is not None and answers is not None:
+        raise ValueError('difficulty_weights and answers are exclusive')
+
+    if weights is not None:
+        if not isinstance(weights, dict):
+            raise ValueError('difficulty_weights must be a mapping')
+        try:
+            weights = {int(difficulty): float(weight) for difficulty, weight in weights.items()}
+        except (TypeError, ValueError):
+            raise ValueError('difficulty_weights must map difficulties to numbers')
+        if not all(math.isfinite(weight) and weight >= 0 for weight in weights.values()) or sum(weights.values()) <= 0:
+            raise ValueError('difficulty_weights must be non-negative and not all zero')
+        return weights
+
+    if answers is not None:
+        if not isinstance(answers, dict):
+            raise ValueError('answers must be a mapping')
+        correct_answers = answers.get('correct')
+        total_answers = answers.get('total')
+        if not all(isinstance(count, int) and not isinstance(count, bool) for count in (correct_answers, total_answers)) \
+                or not 0 <= correct_answers <= total_answers:
+            raise ValueError('answers must have 0 <= correct <= total')
+        return get_adaptive_weights(correct_answers, total_answers)
+
+    return None
+
+
+'''
+pick_random_question(category, previous_questions, difficulty_weights)
+    returns a random question which is not one of the previous questions,
+    within the given category if provided, or None if there are no questions left.
+    With difficulty_weights the difficulty is drawn by these weights.
+'''
+
+
+def pick_random_question(category=None, previous_questions=(), difficulty_weights=None):
+    index = get_question_index()
+    exclude = set(previous_questions)
+
+    while True:
+        if difficulty_weights is None:
+            question_id = index.sample(category, exclude)
+        else:
+            question_id = index.sample_weighted(difficulty_weights, category, exclude)
+        if question_id is None:
+            return None
+
+        question = Question.query.get(question_id)
+        if question is not None:
+            return question
+
+        # the question was deleted by another process; drop it and draw again
+        index.remove(question_id)
+        exclude.add(question_id)
+
+
+'''
+draw_questions(sampler, count, category, exclude, difficulty_weights)
+    returns up to count distinct ids drawn from a QuestionIndex or QuestionSnapshot, adding
+    them to the exclude set. Every draw is uniform among the ids left, so the ids are a
+    uniform sample without replacement, and each one takes the same time for any table size.
+'''
+
+
+def draw_questions(sampler, count, category=None, exclude=None, difficulty_weights=None):
+    exclude = set() if exclude is None else exclude
+    question_ids = []
+
+    while len(question_ids) < count:
+        if difficulty_weights is None:
+            question_id = sampler.sample(category, exclude)
+        else:
+            question_id = sampler.sample_weighted(difficulty_weights, category, exclude)
+        if question_id is None:
+            break
+
+        question_ids.append(question_id)
+        exclude.add(question_id)
+
+    return question_ids
+
+
+'''
+pick_random_questions(category, previous_questions, count, difficulty_weights)
+    returns the rows of up to count distinct random questions which are not previous
+    questions, like pick_random_question, loading them with one query
+'''
+
+
+def pick_random_questions(category=None, previous_questions=(), count=1, difficulty_weights=None):
+    index = get_question_index()
+    exclude = set(previous_questions)
+    questions = []
+
+    while len(questions) < count:
+        question_ids = draw_questions(index, count - len(questions), category, exclude, difficulty_weights)
+        if len(question_ids) == 0:
+            break
+
+        rows = {row.id: row for row in question_rows(Question.query.filter(Question.id.in_(question_ids)))}
+        for question_id in question_ids:
+            if question_id in rows:
+                questions.append(rows[question_id])
+            else:
+                # the question was deleted by another process; drop it, the next round replaces it
+                index.remove(question_id)
+
+    return questions
+
+
+'''
+Question index changes
+    queued per session by the mapper events and applied to the index of the application once
+    the session commits, so that a rolled back write never reaches the index
+'''
+
+
+def add_pending_index_change(question, entry):
+    session = object_session(question)
+    if session is None:
+        apply_index_changes({question.id: entry})
+        return
+
+    session.info.setdefault('pending_question_index', {})[question.id] = entry
+
+
+def apply_index_changes(changes):
+    if not has_app_context() or 'question_index' not in current_app.extensions:
+        return
+
+    index = current_app.extensions['question_index']
+    for question_id, entry in changes.items():
+        if entry is None:
+            index.remove(question_id)
+        else:
+            index.add(question_id, *entry)
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_update')
+def on_question_change(mapper, connection, question):
+    add_pending_index_change(question, (question.category, question.difficulty))
+
+
+@event.listens_for(Question, 'after_delete')
+def on_question_delete(mapper, connection, question):
+    add_pending_index_change(question, None)
+
+
+@event.listens_for(Session, 'after_commit')
+def on_commit(session):
+    changes = session.info.pop('pending_question_index', None)
+    if changes:
+        apply_index_changes(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def on_rollback(session):
+    session.info.pop('pending_question_index', None)
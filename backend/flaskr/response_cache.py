@@ -0,0 +1,226 @@
+import functools
+import hashlib
+import json
+import logging
+import time
+
+from flask import Response, current_app, has_app_context, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import Category, Question
+from flaskr.cache import invalidate_category_cache, invalidate_question_count_cache
+
+logger = logging.getLogger(__name__)
+
+# scopes the cached responses depend on, besides 'category:<id>' for every category
+QUESTIONS_SCOPE = 'questions'
+CATEGORIES_SCOPE = 'categories'
+
+'''
+ResponseCache
+    keeps serialized responses in redis, shared by all workers. Every key contains the
+    current versions of the scopes its response depends on, so bumping a version
+    invalidates all of them at once. Redis errors are logged and the request is served
+    from the database; redis is then skipped for retry_interval seconds.
+'''
+
+
+class ResponseCache:
+    # in-process caches, which are dropped when another process changed their scope
+    LOCAL_CACHES = {
+        QUESTIONS_SCOPE: invalidate_question_count_cache,
+        CATEGORIES_SCOPE: invalidate_category_cache
+    }
+
+    def __init__(self, client, ttl=60, prefix='trivia:response:', retry_interval=5):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.retry_interval = retry_interval
+        self.unavailable_until = 0
+        self.seen_versions = {}
+
+    def is_available(self):
+        return time.monotonic() >= self.unavailable_until
+
+    def get_key(self, route, params, scopes):
+        '''
+        Returns the key of a response, or None if redis is unavailable.
+        '''
+        if not self.is_available():
+            return None
+
+        try:
+            versions = self.client.mget([self.prefix + 'version:' + scope for scope in scopes])
+        except Exception as error:
+            return self.fail(error)
+
+        versions = [int(version or 0) for version in versions]
+        for scope, version in zip(scopes, versions):
+            self.check_local_cache(scope, version)
+
+        digest = hashlib.sha1(json.dumps([params, scopes, versions], sort_keys=True).encode('utf-8')).hexdigest()
+        return f'{self.prefix}{route}:{digest}'
+
+    def get(self, key):
+        try:
+            return self.client.get(key)
+        except Exception as error:
+            return self.fail(error)
+
+    def set(self, key, data):
+        try:
+            self.client.set(key, data, ex=self.ttl)
+        except Exception as error:
+            self.fail(error)
+
+    def bump(self, scopes):
+        if len(scopes) == 0 or not self.is_available():
+            return
+
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for scope in sorted(scopes):
+                pipeline.incr(self.prefix + 'version:' + scope)
+            pipeline.execute()
+        except Exception as error:
+            self.fail(error)
+
+    def check_local_cache(self, scope, version):
+        seen_version = self.seen_versions.get(scope)
+        self.seen_versions[scope] = version
+        if seen_version is not None and seen_version != version and scope in self.LOCAL_CACHES:
+            self.LOCAL_CACHES[scope]()
+
+    def fail(self, error):
+        logger.warning('Response cache unavailable for %d seconds: %s', self.retry_interval, error)
+        self.unavailable_until = time.monotonic() + self.retry_interval
+        return None
+
+
+'''
+create_response_cache(config)
+    creates the shared response cache selected by the RESPONSE_CACHE setting, or None
+'''
+
+
+def create_response_cache(config):
+    store = config.get('RESPONSE_CACHE', 'none')
+
+    if store == 'none':
+        return None
+
+    if store == 'redis':
+        import redis
+        timeout = config.get('RESPONSE_CACHE_TIMEOUT', 0.1)
+        client = redis.Redis.from_url(config['REDIS_URL'], socket_timeout=timeout, socket_connect_timeout=timeout)
+        return ResponseCache(client, ttl=config.get('RESPONSE_CACHE_TTL', 60))
+
+    raise ValueError(f'Unknown response cache: {store}')
+
+
+'''
+cached_response(*scopes)
+    serves a view from the shared response cache, keyed by the path, the query arguments and
+    the JSON body of the request. scopes may contain view arguments like 'category:{category_id}'.
+'''
+
+
+def cached_response(*scopes):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None or request.args.get('stream') == 'true':
+                return view(*args, **kwargs)
+
+            params = {
+                'path': request.path,
+                'args': sorted(request.args.items(multi=True)),
+                'body': normalize_body(request.get_json(silent=True))
+            }
+            key = cache.get_key(view.__name__, params, [scope.format(**kwargs) for scope in scopes])
+            data = cache.get(key) if key is not None else None
+
+            if data is None:
+                response = view(*args, **kwargs)
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+
+                data = response.get_data()
+                if key is not None:
+                    cache.set(key, data)
+
+                # the headers of a hit, so that they do not depend on the state of the cache
+                if response.get_etag()[0] is None:
+                    return conditional_response(response, data)
+                return response
+
+            return conditional_response(Response(data, mimetype='application/json'), data)
+
+        return wrapper
+
+    return decorator
+
+
+def conditional_response(response, data):
+    response.set_etag(hashlib.sha1(data).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def normalize_body(body):
+    # searches are case-insensitive in every mode
+    if isinstance(body, dict) and isinstance(body.get('search_term'), str):
+        return dict(body, search_term=body['search_term'].lower())
+    return body
+
+
+def bump_response_cache(scopes):
+    if has_app_context() and current_app.extensions.get('response_cache') is not None:
+        current_app.extensions['response_cache'].bump(scopes)
+
+
+def get_category_scope(category):
+    return f'category:{category}'
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_update')
+@event.listens_for(Question, 'after_delete')
+def on_question_change(mapper, connection, question):
+    session = object_session(question)
+    if session is None:
+        return
+
+    scopes = session.info.setdefault('response_cache_scopes', set())
+    scopes.add(QUESTIONS_SCOPE)
+    scopes.add(get_category_scope(question.category))
+
+    # a question moved to another category changes the listing of both
+    for category in inspect(question).attrs.category.history.deleted or ():
+        scopes.add(get_category_scope(category))
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def on_category_change(mapper, connection, category):
+    session = object_session(category)
+    if session is None:
+        return
+
+    scopes = session.info.setdefault('response_cache_scopes', set())
+    scopes.add(CATEGORIES_SCOPE)
+    scopes.add(get_category_scope(category.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def on_commit(session):
+    bump_response_cache(session.info.pop('response_cache_scopes', set()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def on_rollback(session):
+    session.info.pop('response_cache_scopes', None)
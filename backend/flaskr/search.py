@@ -0,0 +1,252 @@
+import bisect
+import math
+import re
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, literal_column
+
+from models import db, Question
+from flaskr.serialization import question_rows
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+SEARCH_MODES = ('substring', 'fulltext')
+
+'''
+tokenize(text)
+    splits a text into lowercase word tokens
+'''
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+'''
+InvertedIndex
+    an in-process full-text index of the question texts, mapping every token
+    to the ids of the questions containing it
+'''
+
+
+class InvertedIndex:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.built_at = None
+        self.postings = {}
+        self.documents = {}
+        # sorted vocabulary, used for prefix lookups with bisect
+        self.tokens = []
+
+    def is_stale(self):
+        return self.built_at is None or (self.ttl is not None and time.monotonic() - self.built_at > self.ttl)
+
+    def invalidate(self):
+        with self.lock:
+            self.built_at = None
+
+    def build(self):
+        rows = db.session.query(Question.id, Question.question).all()
+
+        with self.lock:
+            self.postings = {}
+            self.documents = {}
+            for question_id, question in rows:
+                self._add(question_id, question, keep_sorted=False)
+            self.tokens = sorted(self.postings)
+            self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self.is_stale():
+            self.build()
+
+    def add(self, question_id, question):
+        with self.lock:
+            if self.built_at is not None:
+                self._add(question_id, question)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.built_at is not None:
+                self._remove(question_id)
+
+    def search(self, term):
+        '''
+        Returns the ids of the questions containing every token of the term, where the
+        last token may be a prefix, ranked by the inverse document frequency of the matches.
+        '''
+        self.ensure_built()
+        query_tokens = tokenize(term)
+        if len(query_tokens) == 0:
+            return []
+
+        with self.lock:
+            document_count = max(len(self.documents), 1)
+            scores = None
+
+            for position, query_token in enumerate(query_tokens):
+                # the last token is still being typed, so it matches as a prefix
+                if position == len(query_tokens) - 1:
+                    matched_tokens = self._prefixed(query_token)
+                else:
+                    matched_tokens = [query_token] if query_token in self.postings else []
+
+                token_scores = {}
+                for token in matched_tokens:
+                    postings = self.postings[token]
+                    weight = math.log(1 + document_count / len(postings))
+                    for question_id in postings:
+                        token_scores[question_id] = max(token_scores.get(question_id, 0), weight)
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {
+                        question_id: score + token_scores[question_id]
+                        for question_id, score in scores.items()
+                        if question_id in token_scores
+                    }
+
+                if len(scores) == 0:
+                    return []
+
+        return [question_id for question_id, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))]
+
+    def _prefixed(self, prefix):
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + '\uffff')
+        return self.tokens[start:end]
+
+    def _add(self, question_id, question, keep_sorted=True):
+        if question_id in self.documents:
+            self._remove(question_id)
+
+        tokens = set(tokenize(question))
+        self.documents[question_id] = tokens
+        for token in tokens:
+            if token not in self.postings:
+                self.postings[token] = set()
+                if keep_sorted:
+                    bisect.insort(self.tokens, token)
+            self.postings[token].add(question_id)
+
+    def _remove(self, question_id):
+        for token in self.documents.pop(question_id, ()):
+            postings = self.postings[token]
+            postings.discard(question_id)
+            if len(postings) == 0:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+
+'''
+get_search_index()
+    returns the inverted index bound to the current application
+'''
+
+
+def get_search_index():
+    index = current_app.extensions.get('search_index')
+    if index is None:
+        index = InvertedIndex(ttl=current_app.config.get('SEARCH_INDEX_TTL', 300))
+        current_app.extensions['search_index'] = index
+    return index
+
+
+'''
+search_questions(search_term, mode, offset, limit)
+    returns the rows of the questions matching the search term, starting at offset
+    and at most limit of them if given, together with the number of all matches
+
+    substring: questions containing the search term, ordered by id.
+        On PostgreSQL the ILIKE filter is served by a trigram index.
+    fulltext: questions containing every word of the search term, the last word
+        matching as a prefix, ordered by rank. On PostgreSQL this uses a tsvector
+        index, on other databases an in-process inverted index.
+'''
+
+
+def search_questions(search_term, mode='substring', offset=0, limit=None):
+    if uses_database(mode):
+        query = question_rows(search_questions_query(search_term, mode))
+        if offset == 0 and limit is None:
+            questions = query.all()
+            return questions, len(questions)
+
+        total_questions = query.order_by(None).count()
+        return query.offset(offset).limit(limit).all(), total_questions
+
+    question_ids = get_search_index().search(search_term)
+    end = None if limit is None else offset + limit
+    return load_questions(question_ids[offset:end]), len(question_ids)
+
+
+'''
+iter_search_questions(search_term, mode, batch_size)
+    yields the rows of the questions matching the search term, loading at most batch_size
+    of them at once through a server-side cursor where the database supports one
+'''
+
+
+def iter_search_questions(search_term, mode='substring', batch_size=500):
+    if uses_database(mode):
+        query = question_rows(search_questions_query(search_term, mode))
+        yield from query.execution_options(stream_results=True).yield_per(batch_size)
+        return
+
+    question_ids = get_search_index().search(search_term)
+    for start in range(0, len(question_ids), batch_size):
+        yield from load_questions(question_ids[start:start + batch_size])
+
+
+def uses_database(mode):
+    return mode == 'substring' or db.engine.dialect.name == 'postgresql'
+
+
+def load_questions(question_ids):
+    rows = {row.id: row for row in question_rows(Question.query.filter(Question.id.in_(question_ids)))}
+    return [rows[question_id] for question_id in question_ids if question_id in rows]
+
+
+'''
+search_questions_query(search_term, mode)
+    returns the database query of search_questions, for the modes it can run in the database
+'''
+
+
+def search_questions_query(search_term, mode='substring'):
+    if mode == 'substring':
+        # LIKE is case-insensitive for ASCII on SQLite, which saves the lower() calls of ilike
+        if search_term.isascii() and db.engine.dialect.name == 'sqlite':
+            return Question.query.filter(Question.question.like(f'%{search_term}%')).order_by(Question.id)
+        return Question.query.filter(Question.question.ilike(f'%{search_term}%')).order_by(Question.id)
+
+    tokens = tokenize(search_term)
+    if len(tokens) == 0:
+        return Question.query.filter(db.false())
+
+    # the expression must match the one of the ix_questions_question_tsv index
+    document = db.func.to_tsvector(literal_column("'english'::regconfig"), db.func.coalesce(Question.question, literal_column("''")))
+    query = db.func.to_tsquery(
+        literal_column("'english'::regconfig"),
+        ' & '.join(tokens[:-1] + [tokens[-1] + ':*'])
+    )
+    return Question.query.filter(document.op('@@')(query)).order_by(
+        db.func.ts_rank(document, query).desc(),
+        Question.id
+    )
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_update')
+def on_question_change(mapper, connection, question):
+    if has_app_context() and 'search_index' in current_app.extensions:
+        current_app.extensions['search_index'].add(question.id, question.question)
+
+
+@event.listens_for(Question, 'after_delete')
+def on_question_delete(mapper, connection, question):
+    if has_app_context() and 'search_index' in current_app.extensions:
+        current_app.extensions['search_index'].remove(question.id)
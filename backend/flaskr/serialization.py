@@ -0,0 +1,106 @@
+import hashlib
+import json
+
+from flask import Response, current_app, request
+
+from models import Question
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+
+'''
+JSON encoders
+    functions serializing a response body to UTF-8 bytes. Integer keys, like the ones
+    of the categories mapping, are written as strings by all of them.
+'''
+
+
+def stdlib_dumps(body):
+    return json.dumps(body, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def orjson_dumps(body):
+    return orjson.dumps(body, option=orjson.OPT_NON_STR_KEYS)
+
+
+JSON_ENCODERS = {'json': stdlib_dumps}
+if orjson is not None:
+    JSON_ENCODERS['orjson'] = orjson_dumps
+
+
+'''
+load_json_encoder(name)
+    returns the JSON encoder of the given name, 'auto' picks orjson if it is installed
+'''
+
+
+def load_json_encoder(name='auto'):
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in JSON_ENCODERS else 'json'
+
+    if name not in JSON_ENCODERS:
+        raise ValueError(f'Unknown JSON encoder: {name}')
+
+    return JSON_ENCODERS[name]
+
+
+'''
+dumps(body)
+    serializes the body with the JSON encoder configured in JSON_ENCODER
+'''
+
+
+def dumps(body):
+    encoder = current_app.extensions.get('json_encoder')
+    if encoder is None:
+        encoder = load_json_encoder(current_app.config.get('JSON_ENCODER', 'auto'))
+        current_app.extensions['json_encoder'] = encoder
+    return encoder(body)
+
+
+def json_response(body, status=200):
+    return Response(dumps(body), status=status, mimetype='application/json')
+
+
+'''
+conditional_json_response(body)
+    returns the JSON response with a strong ETag of its content, answering
+    requests with a matching If-None-Match header with 304 Not Modified
+'''
+
+
+def conditional_json_response(body):
+    response = json_response(body)
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+'''
+question_rows(query)
+    narrows a Question query to the serialized columns, so that it returns plain
+    rows instead of hydrating ORM objects
+'''
+
+
+def question_rows(query):
+    return query.with_entities(*QUESTION_COLUMNS)
+
+
+'''
+format_question_row(row)
+    returns the same dict as Question.format() for a row of question_rows
+'''
+
+
+def format_question_row(row):
+    return dict(zip(QUESTION_FIELDS, row))
+
+
+def format_question_rows(rows):
+    return [dict(zip(QUESTION_FIELDS, row)) for row in rows]
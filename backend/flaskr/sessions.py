@@ -0,0 +1,129 @@
+import collections
+import secrets
+import threading
+import time
+
+'''
+MemorySessionStore
+    keeps quiz sessions in the current process, evicting sessions which
+    were not used for longer than ttl seconds
+'''
+
+
+class MemorySessionStore:
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # ordered by expiry, since every access moves a session to the end
+        self.sessions = collections.OrderedDict()
+
+    def create(self, question_ids):
+        session_id = secrets.token_urlsafe(16)
+
+        with self.lock:
+            self.evict_expired()
+            self.sessions[session_id] = [time.monotonic() + self.ttl, 0, list(question_ids)]
+
+        return session_id
+
+    def next(self, session_id):
+        '''
+        Advances the session cursor and returns the next question id,
+        or None when the session is exhausted. Raises KeyError for unknown sessions.
+        '''
+        with self.lock:
+            self.evict_expired()
+            session = self.sessions[session_id]
+            self.sessions.move_to_end(session_id)
+            session[0] = time.monotonic() + self.ttl
+
+            expires_at, cursor, question_ids = session
+            if cursor >= len(question_ids):
+                return None
+
+            session[1] = cursor + 1
+            return question_ids[cursor]
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def evict_expired(self):
+        now = time.monotonic()
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session[0] > now:
+                break
+            del self.sessions[session_id]
+
+
+'''
+RedisSessionStore
+    keeps quiz sessions in redis as a list of question ids plus a cursor,
+    both expiring after ttl seconds without use
+'''
+
+
+class RedisSessionStore:
+    def __init__(self, client, ttl=3600, prefix='trivia:quiz-session:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def keys(self, session_id):
+        return self.prefix + session_id + ':questions', self.prefix + session_id + ':cursor'
+
+    def create(self, question_ids):
+        session_id = secrets.token_urlsafe(16)
+        questions_key, cursor_key = self.keys(session_id)
+
+        pipe = self.client.pipeline()
+        pipe.set(cursor_key, 0, ex=self.ttl)
+        # redis can not hold empty lists, so only the cursor marks an empty session
+        if len(question_ids) > 0:
+            pipe.rpush(questions_key, *question_ids)
+            pipe.expire(questions_key, self.ttl)
+        pipe.execute()
+
+        return session_id
+
+    def next(self, session_id):
+        questions_key, cursor_key = self.keys(session_id)
+
+        pipe = self.client.pipeline()
+        pipe.exists(cursor_key)
+        pipe.incr(cursor_key)
+        pipe.expire(cursor_key, self.ttl)
+        pipe.expire(questions_key, self.ttl)
+        exists, cursor, _, _ = pipe.execute()
+
+        if not exists:
+            # incr created a cursor for an unknown session, remove it again
+            self.client.delete(cursor_key)
+            raise KeyError(session_id)
+
+        question_id = self.client.lindex(questions_key, cursor - 1)
+        return int(question_id) if question_id is not None else None
+
+    def delete(self, session_id):
+        return self.client.delete(*self.keys(session_id)) > 0
+
+
+'''
+create_session_store(config)
+    creates the quiz session store selected by the QUIZ_SESSION_STORE setting
+'''
+
+
+def create_session_store(config):
+    store = config.get('QUIZ_SESSION_STORE', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', 3600)
+
+    if store == 'memory':
+        return MemorySessionStore(ttl=ttl)
+
+    if store == 'redis':
+        import redis
+        return RedisSessionStore(redis.Redis.from_url(config['REDIS_URL']), ttl=ttl)
+
+    raise ValueError(f'Unknown quiz session store: {store}')
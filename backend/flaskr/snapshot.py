@@ -0,0 +1,479 @@
+import array
+import bisect
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Category, Question
+from flaskr.quiz import draw_difficulty, draw_from_bucket
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TRIVSNAP'
+ALIGNMENT = 8
+# NULL categories and difficulties in the integer arrays
+NULL = -2 ** 31
+# markers next to the snapshot file of writes which are not built into it yet
+DIRTY_SUFFIX = '.dirty'
+BUILDING_SUFFIX = '.building'
+
+'''
+Question snapshot file
+    MAGIC, the length of the JSON header as a little-endian uint32, the header, and the
+    sections it lists, each aligned to 8 bytes and in the byte order of the machine:
+
+    ids, question_categories, difficulties
+                                    int32 arrays of the questions, ordered by id
+    question_offsets, answer_offsets, search_offsets
+                                    uint32 arrays of n + 1 offsets into the blobs
+    questions, answers              the UTF-8 texts of the questions and answers
+    search_texts                    the lowercased question texts, each ended by a NUL byte
+    category_order                  question positions ordered by (category, id)
+    difficulty_order                question positions ordered by (difficulty, id), followed
+                                    by question positions ordered by (category, difficulty, id)
+
+    The header holds the categories and the [start, end) ranges of every category, every
+    difficulty and every (category, difficulty) in the orders.
+'''
+
+
+def write_snapshot(path, questions, categories):
+    '''
+    Writes the (id, question, answer, category, difficulty) rows ordered by id and the
+    (id, type) category rows to a snapshot file, which atomically replaces path.
+    '''
+    ids = array.array('i')
+    question_categories = array.array('i')
+    difficulties = array.array('i')
+    texts = [bytearray(), bytearray(), bytearray()]
+    offsets = [array.array('I', [0]), array.array('I', [0]), array.array('I', [0])]
+
+    for question_id, question, answer, category, difficulty in questions:
+        ids.append(question_id)
+        question_categories.append(NULL if category is None else category)
+        difficulties.append(NULL if difficulty is None else difficulty)
+        for blob, blob_offsets, text in zip(texts, offsets, (question, answer, (question or '').lower() + '\0')):
+            blob += (text or '').encode('utf-8')
+            blob_offsets.append(len(blob))
+
+    positions = range(len(ids))
+    category_order = array.array('i', sorted(positions, key=question_categories.__getitem__))
+    difficulty_order = array.array('i', sorted(positions, key=difficulties.__getitem__))
+    difficulty_order.extend(sorted(positions, key=lambda position: (question_categories[position], difficulties[position])))
+
+    category_ranges = get_ranges(category_order, lambda position: (get_value(question_categories[position]),))
+    difficulty_ranges = get_ranges(difficulty_order[:len(ids)], lambda position: (get_value(difficulties[position]),))
+    category_difficulty_ranges = [
+        [category, difficulty, start + len(ids), end + len(ids)]
+        for category, difficulty, start, end in get_ranges(
+            difficulty_order[len(ids):], lambda position: (get_value(question_categories[position]), get_value(difficulties[position]))
+        )
+    ]
+
+    sections = [
+        ('ids', ids), ('question_categories', question_categories), ('difficulties', difficulties),
+        ('question_offsets', offsets[0]), ('answer_offsets', offsets[1]), ('search_offsets', offsets[2]),
+        ('questions', texts[0]), ('answers', texts[1]), ('search_texts', texts[2]),
+        ('category_order', category_order), ('difficulty_order', difficulty_order)
+    ]
+    header = {
+        'byteorder': sys.byteorder,
+        'categories': [[category_id, category_type] for category_id, category_type in categories],
+        'category_ranges': category_ranges,
+        'difficulty_ranges': difficulty_ranges,
+        'category_difficulty_ranges': category_difficulty_ranges,
+        'sections': {}
+    }
+    offset = 0
+    for name, data in sections:
+        typecode = data.typecode if isinstance(data, array.array) else 'B'
+        length = len(data) * (data.itemsize if isinstance(data, array.array) else 1)
+        header['sections'][name] = [offset, length, typecode]
+        offset = align(offset + length)
+
+    header_data = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, prefix='.snapshot-', delete=False) as snapshot_file:
+        try:
+            snapshot_file.write(MAGIC + struct.pack('<I', len(header_data)) + header_data)
+            snapshot_file.write(b'\0' * (align(snapshot_file.tell()) - snapshot_file.tell()))
+            data_start = snapshot_file.tell()
+            for name, data in sections:
+                snapshot_file.seek(data_start + header['sections'][name][0])
+                snapshot_file.write(data if isinstance(data, bytearray) else data.tobytes())
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        except BaseException:
+            os.unlink(snapshot_file.name)
+            raise
+
+    # readers keep the pages of the file they mapped until they map the new one
+    os.replace(snapshot_file.name, path)
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def get_value(value):
+    return None if value == NULL else value
+
+
+def get_ranges(order, get_key):
+    ranges = []
+    for index, position in enumerate(order):
+        key = get_key(position)
+        if len(ranges) == 0 or tuple(ranges[-1][:-2]) != key:
+            ranges.append(list(key) + [index, index])
+        ranges[-1][-1] = index + 1
+    return ranges
+
+
+'''
+QuestionSnapshot
+    a memory-mapped snapshot file. All processes mapping the same file share its pages, and
+    questions are read straight from the arrays and blobs without ORM objects.
+'''
+
+
+class QuestionSnapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_id = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a question snapshot')
+        header_length, = struct.unpack_from('<I', self.map, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(self.map[header_start:header_start + header_length])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f'{path} was written with another byte order')
+
+        data_start = align(header_start + header_length)
+        view = memoryview(self.map)
+        for name, (offset, length, typecode) in header['sections'].items():
+            setattr(self, name, view[data_start + offset:data_start + offset + length].cast(typecode))
+        self.search_start = data_start + header['sections']['search_texts'][0]
+
+        self.categories = {category_id: category_type for category_id, category_type in header['categories']}
+        self.category_ranges = {category: (start, end) for category, start, end in header['category_ranges']}
+        # keyed like the buckets of QuestionIndex, by difficulty for all categories
+        self.difficulty_ranges = {(None, difficulty): (start, end) for difficulty, start, end in header['difficulty_ranges']}
+        self.difficulty_ranges.update(
+            ((category, difficulty), (start, end)) for category, difficulty, start, end in header['category_difficulty_ranges'] if category is not None
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, question_id):
+        position = bisect.bisect_left(self.ids, question_id)
+        if position < len(self.ids) and self.ids[position] == question_id:
+            return position
+        return None
+
+    def row(self, position):
+        '''
+        Returns the (id, question, answer, category, difficulty) row of a position, like question_rows.
+        '''
+        return (
+            self.ids[position],
+            str(self.questions[self.question_offsets[position]:self.question_offsets[position + 1]], 'utf-8'),
+            str(self.answers[self.answer_offsets[position]:self.answer_offsets[position + 1]], 'utf-8'),
+            get_value(self.question_categories[position]),
+            get_value(self.difficulties[position])
+        )
+
+    def rows(self, positions):
+        return [self.row(position) for position in positions]
+
+    def format_category(self, category_id):
+        return {'id': category_id, 'type': self.categories[category_id]} if category_id in self.categories else None
+
+    def category_positions(self, category):
+        start, end = self.category_ranges.get(category, (0, 0))
+        return self.category_order[start:end]
+
+    def search(self, search_term):
+        '''
+        Returns the positions of the questions containing the search term, ignoring case.
+        '''
+        term = search_term.lower().encode('utf-8')
+        # like LIKE '%%', an empty term matches every question
+        if len(term) == 0:
+            return list(range(len(self)))
+        # the NUL bytes end the texts, no question contains one
+        if b'\0' in term:
+            return []
+
+        end = self.search_start + self.search_offsets[-1]
+        positions = []
+        start = self.search_start
+        while start < end:
+            match = self.map.find(term, start, end)
+            if match < 0:
+                break
+
+            position = bisect.bisect_right(self.search_offsets, match - self.search_start) - 1
+            positions.append(position)
+            # continue after the matching question, so that it is returned once
+            start = self.search_start + self.search_offsets[position + 1]
+
+        return positions
+
+    def sample(self, category=None, exclude=()):
+        '''
+        Returns a uniformly random id, like QuestionIndex.sample.
+        '''
+        if not isinstance(exclude, (set, frozenset)):
+            exclude = set(exclude)
+
+        if category is None:
+            return draw_from_bucket(self.ids, exclude)
+        return draw_from_bucket(SnapshotBucket(self.ids, self.category_positions(category)), exclude)
+
+    def sample_weighted(self, weights, category=None, exclude=()):
+        '''
+        Returns a random id with its difficulty drawn by the weights, like QuestionIndex.sample_weighted.
+        '''
+        if not isinstance(exclude, (set, frozenset)):
+            exclude = set(exclude)
+
+        excluded = {}
+        for question_id in exclude:
+            position = self.find(question_id)
+            if position is not None and (category is None or self.question_categories[position] == category):
+                difficulty = get_value(self.difficulties[position])
+                excluded[difficulty] = excluded.get(difficulty, 0) + 1
+
+        remaining = {}
+        for difficulty in weights:
+            start, end = self.difficulty_ranges.get((category, difficulty), (0, 0))
+            remaining[difficulty] = end - start - excluded.get(difficulty, 0)
+
+        difficulty = draw_difficulty(weights, remaining)
+        if difficulty is None:
+            return None
+
+        start, end = self.difficulty_ranges[(category, difficulty)]
+        return draw_from_bucket(SnapshotBucket(self.ids, self.difficulty_order[start:end]), exclude)
+
+
+class SnapshotBucket:
+    # the ids of a range of positions, as a sequence for draw_from_bucket
+    def __init__(self, ids, positions):
+        self.ids = ids
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        return self.ids[self.positions[index]]
+
+
+'''
+SnapshotStore
+    the snapshot of the current application. Every access compares the file with the one
+    mapped, so that a snapshot swapped in by another process is used by the next request.
+    While a write is not built into the snapshot yet, see SnapshotBuilder, there is none.
+'''
+
+
+class SnapshotStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    def get(self):
+        if os.path.exists(self.path + DIRTY_SUFFIX) or os.path.exists(self.path + BUILDING_SUFFIX):
+            return None
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.file_id == (stat.st_dev, stat.st_ino, stat.st_mtime_ns):
+            return snapshot
+
+        with self.lock:
+            if self.snapshot is snapshot:
+                try:
+                    self.snapshot = QuestionSnapshot(self.path)
+                except FileNotFoundError:
+                    self.snapshot = None
+            return self.snapshot
+
+
+'''
+get_snapshot()
+    returns the question snapshot of the current application, or None if QUESTION_SNAPSHOT_PATH
+    is not set or its file has not been built
+'''
+
+
+def get_snapshot():
+    path = current_app.config.get('QUESTION_SNAPSHOT_PATH')
+    if not path:
+        return None
+
+    store = current_app.extensions.get('question_snapshot')
+    if store is None or store.path != path:
+        store = SnapshotStore(path)
+        current_app.extensions['question_snapshot'] = store
+    return store.get()
+
+
+'''
+build_snapshot(path, only_if_dirty)
+    exports the questions and categories tables of the primary database to the snapshot file
+    and returns the number of questions. Builds are serialized with a lock file, so that the
+    last snapshot swapped in is the one built last. A build takes over the dirty marker of the
+    writes before it, which is removed once their snapshot is swapped in; with only_if_dirty
+    nothing is built, and None returned, if another build already took it over.
+'''
+
+
+def build_snapshot(path, only_if_dirty=False):
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            os.replace(path + DIRTY_SUFFIX, path + BUILDING_SUFFIX)
+        except FileNotFoundError:
+            if only_if_dirty:
+                return None
+
+        with db.engine.connect() as connection:
+            questions = connection.execute(db.select([
+                Question.id, Question.question, Question.answer, Question.category, Question.difficulty
+            ]).order_by(Question.id)).fetchall()
+            categories = connection.execute(db.select([Category.id, Category.type]).order_by(Category.id)).fetchall()
+        write_snapshot(path, questions, categories)
+        remove_file(path + BUILDING_SUFFIX)
+
+    return len(questions)
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+'''
+SnapshotBuilder
+    rebuilds the snapshot at path on a background thread after writes, so that a write does
+    not wait for the export of the tables. mark_dirty() creates the dirty marker next to the
+    snapshot, which makes the reads of every worker go to the database until the write is
+    built in, and wakes the builder. The builder waits delay seconds for more writes, so that
+    a burst of them is built once.
+'''
+
+
+class SnapshotBuilder:
+    def __init__(self, app, path, delay=0.5):
+        self.app = app
+        self.path = path
+        self.delay = delay
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.thread_pid = None
+        self.builds = 0
+
+    def mark_dirty(self):
+        open(self.path + DIRTY_SUFFIX, 'a').close()
+        self.ensure_started()
+        self.wake.set()
+
+    def ensure_started(self):
+        # a forked worker does not inherit the builder thread of its parent
+        if self.thread is not None and self.thread_pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.thread is None or self.thread_pid != os.getpid():
+                self.wake = threading.Event()
+                self.thread = threading.Thread(target=self.run, name='snapshot-builder', daemon=True)
+                self.thread_pid = os.getpid()
+                self.thread.start()
+
+    def run(self):
+        wake = self.wake
+        while True:
+            wake.wait()
+            time.sleep(self.delay)
+            # writes from here on wake the builder for another build
+            wake.clear()
+            with self.app.app_context():
+                self.build()
+
+    def build(self):
+        try:
+            if build_snapshot(self.path, only_if_dirty=True) is not None:
+                self.builds += 1
+        except Exception:
+            # without the outdated snapshot the reads go to the database until the next build
+            logger.exception('Could not rebuild the question snapshot %s, removing it', self.path)
+            remove_file(self.path)
+            remove_file(self.path + BUILDING_SUFFIX)
+
+
+'''
+mark_snapshot_dirty()
+    marks the snapshot of the current application as outdated by a committed write and
+    schedules its rebuild
+'''
+
+
+def mark_snapshot_dirty():
+    if not has_app_context() or not current_app.config.get('QUESTION_SNAPSHOT_PATH'):
+        return
+
+    path = current_app.config['QUESTION_SNAPSHOT_PATH']
+    builder = current_app.extensions.get('snapshot_builder')
+    if builder is None or builder.path != path:
+        builder = SnapshotBuilder(current_app._get_current_object(), path, current_app.config.get('QUESTION_SNAPSHOT_DELAY', 0.5))
+        current_app.extensions['snapshot_builder'] = builder
+    builder.mark_dirty()
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_update')
+@event.listens_for(Question, 'after_delete')
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def on_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['question_snapshot_changed'] = True
+
+
+# runs before the response cache versions are bumped, so that no worker caches the old snapshot
+@event.listens_for(Session, 'after_commit', insert=True)
+def on_commit(session):
+    if session.info.pop('question_snapshot_changed', False):
+        mark_snapshot_dirty()
+
+
+@event.listens_for(Session, 'after_rollback')
+def on_rollback(session):
+    session.info.pop('question_snapshot_changed', None)
@@ -0,0 +1,48 @@
+"""convert questions.category to an indexed integer foreign key
+
+Revision ID: 5a1e3f0c2b7d
+Revises: 
+Create Date: 2026-10-17 21:04:12.318214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1e3f0c2b7d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases restored from trivia.psql already have an integer column,
+    # databases created from the previous models have a varchar one
+    inspector = sa.inspect(op.get_bind())
+    foreign_keys = [foreign_key['name'] for foreign_key in inspector.get_foreign_keys('questions')]
+    indexes = [index['name'] for index in inspector.get_indexes('questions')]
+
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.alter_column(
+            'category',
+            existing_type=sa.String(),
+            type_=sa.Integer(),
+            postgresql_using='category::integer'
+        )
+        if 'fk_questions_category_categories' not in foreign_keys:
+            batch_op.create_foreign_key('fk_questions_category_categories', 'categories', ['category'], ['id'])
+        if 'ix_questions_category_id' not in indexes:
+            batch_op.create_index('ix_questions_category_id', ['category', 'id'])
+
+
+def downgrade():
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_index('ix_questions_category_id')
+        batch_op.drop_constraint('fk_questions_category_categories', type_='foreignkey')
+        batch_op.alter_column(
+            'category',
+            existing_type=sa.Integer(),
+            type_=sa.String(),
+            postgresql_using='category::varchar'
+        )
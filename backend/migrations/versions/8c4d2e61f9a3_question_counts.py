@@ -0,0 +1,40 @@
+"""add the question_counts table, filled with the current counts
+
+Revision ID: 8c4d2e61f9a3
+Revises: 5a1e3f0c2b7d
+Create Date: 2026-10-17 21:42:37.104655
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4d2e61f9a3'
+down_revision = '5a1e3f0c2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the table may already have been created and filled by db.create_all()
+    if 'question_counts' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table(
+        'question_counts',
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['category_id'], ['categories.id'], name='fk_question_counts_category_categories', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('category_id')
+    )
+    op.execute(
+        'INSERT INTO question_counts (category_id, count) '
+        'SELECT categories.id, count(questions.id) '
+        'FROM categories LEFT OUTER JOIN questions ON questions.category = categories.id '
+        'GROUP BY categories.id'
+    )
+
+
+def downgrade():
+    op.drop_table('question_counts')
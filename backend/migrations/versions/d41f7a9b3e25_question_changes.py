@@ -0,0 +1,40 @@
+"""add the question_changes table, with a change for every existing question
+
+Revision ID: d41f7a9b3e25
+Revises: 8c4d2e61f9a3
+Create Date: 2026-10-17 22:05:51.640197
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f7a9b3e25'
+down_revision = '8c4d2e61f9a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the table may already have been created and filled by db.create_all()
+    if 'question_changes' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table(
+        'question_changes',
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('question_id', sa.Integer(), nullable=False),
+        sa.Column('deleted', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('version'),
+        sa.UniqueConstraint('question_id'),
+        sqlite_autoincrement=True
+    )
+    op.execute(
+        'INSERT INTO question_changes (question_id, deleted) '
+        'SELECT id, false FROM questions ORDER BY id'
+    )
+
+
+def downgrade():
+    op.drop_table('question_changes')
@@ -1,6 +1,11 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import functools
+import sqlite3
+from flask import g, has_app_context
+from sqlalchemy import Boolean, Column, String, Integer, DDL, ForeignKey, Index, create_engine, event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_name = 'trivia'
@@ -8,26 +13,169 @@ database_host = 'localhost'
 database_port = 5432
 database_user = 'dbuser'
 database_pass = 'dbuser'
-database_path = "postgresql://{}:{}@{}:{}/{}".format(database_user, database_pass, database_host, database_port, database_name)
+database_path = os.environ.get('DATABASE_URL', "postgresql://{}:{}@{}:{}/{}".format(database_user, database_pass, database_host, database_port, database_name))
+
+'''
+RoutingSession
+    sends the queries of read only views to the read replica, when one is configured,
+    and everything else (including any flush) to the primary database
+'''
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context() and g.get('use_read_replica', False) \
+                and 'replica' in (self.app.config.get('SQLALCHEMY_BINDS') or {}):
+            return self.db.get_engine(self.app, bind='replica')
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+'''
+read_only(view)
+    marks a view as read only, so that its queries may be served by the read replica
+'''
+
+
+def read_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_read_replica = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+'''
+get_engine_options(database_uri, config)
+    returns the SQLAlchemy engine options for the database at database_uri,
+    built from the DATABASE_* settings of config
+'''
+
+
+def get_engine_options(database_uri, config):
+    options = {}
+    backend = make_url(database_uri).get_backend_name()
+
+    # sqlite uses its own pools, which do not take the pool sizing options
+    if backend != 'sqlite':
+        for key, option in [
+            ('DATABASE_POOL_SIZE', 'pool_size'),
+            ('DATABASE_MAX_OVERFLOW', 'max_overflow'),
+            ('DATABASE_POOL_TIMEOUT', 'pool_timeout'),
+            ('DATABASE_POOL_RECYCLE', 'pool_recycle')
+        ]:
+            if config.get(key) is not None:
+                options[option] = config[key]
+
+    if config.get('DATABASE_POOL_PRE_PING'):
+        options['pool_pre_ping'] = True
+
+    if backend == 'postgresql' and config.get('DATABASE_STATEMENT_TIMEOUT'):
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(config['DATABASE_STATEMENT_TIMEOUT'])}
+
+    return options
 
-db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. The engine is created on the first
+    query, so that the application starts without connecting to the database.
 '''
 
 
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_uri=None):
+    database_uri = database_uri or app.config.get('DATABASE_URL') or database_path
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(database_uri, app.config)
+
+    if app.config.get('DATABASE_REPLICA_URL'):
+        app.config["SQLALCHEMY_BINDS"] = dict(app.config.get("SQLALCHEMY_BINDS") or {}, replica=app.config['DATABASE_REPLICA_URL'])
+
     db.app = app
     db.init_app(app)
-    db.create_all()
 
     return db
 
 
+'''
+create_schema()
+    creates the tables of the models, with the question counts, in an empty database.
+    Returns False without changes if the questions table already exists.
+'''
+
+
+def create_schema():
+    if db.engine.dialect.has_table(db.engine, 'questions'):
+        return False
+
+    db.create_all()
+    return True
+
+
+def is_memory_database(database_uri):
+    url = make_url(database_uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+'''
+SQLite connections
+    enforce foreign keys, like PostgreSQL does for the cascades of question_counts, and
+    replace lower(), which ilike compiles to on SQLite, with one folding the case of
+    all characters instead of ASCII only. A :memory: database is a single connection
+    shared by the threads of its app, so every app has a database of its own.
+'''
+
+
+def sqlite_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+@event.listens_for(Engine, 'connect')
+def on_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
+        dbapi_connection.create_function('lower', 1, sqlite_lower, deterministic=True)
+
+
+'''
+get_pool_stats(app)
+    returns the connection pool statistics of the primary database and of the read replica
+'''
+
+
+def get_pool_stats(app):
+    engines = {'primary': db.get_engine(app)}
+    if 'replica' in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        engines['replica'] = db.get_engine(app, bind='replica')
+
+    stats = {}
+    for name, engine in engines.items():
+        pool = engine.pool
+        stats[name] = {
+            'pool': type(pool).__name__,
+            'size': pool.size() if hasattr(pool, 'size') else None,
+            'checked_in': pool.checkedin() if hasattr(pool, 'checkedin') else None,
+            'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+            'status': pool.status()
+        }
+
+    return stats
+
+
 '''
 Question
 
@@ -36,11 +184,15 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # serves the category listings and the quiz draws, both filtering on category and ordering by id
+        Index('ix_questions_category_id', 'category', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', name='fk_questions_category_categories'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -70,6 +222,33 @@ class Question(db.Model):
         }
 
 
+'''
+Search indexes
+    trigram and full-text GIN indexes on the question text (PostgreSQL only),
+    created with the questions table or later with create_search_indexes()
+'''
+
+search_index_statements = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions USING gin (question gin_trgm_ops)',
+    "CREATE INDEX IF NOT EXISTS ix_questions_question_tsv ON questions USING gin (to_tsvector('english'::regconfig, coalesce(question, '')))"
+]
+
+for statement in search_index_statements:
+    event.listen(Question.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+def create_search_indexes():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    with db.engine.begin() as connection:
+        for statement in search_index_statements:
+            connection.execute(statement)
+
+    return True
+
+
 '''
 Category
 
@@ -94,3 +273,280 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+'''
+QuestionCount
+    the number of questions per category, kept up to date in the transaction of every
+    question insert, update and delete, so that totals are read without counting the questions
+'''
+
+
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category_id = Column(Integer, ForeignKey('categories.id', name='fk_question_counts_category_categories', ondelete='CASCADE'), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+question_counts = QuestionCount.__table__
+
+count_questions_statement = '''
+    SELECT categories.id, count(questions.id)
+    FROM categories LEFT OUTER JOIN questions ON questions.category = categories.id
+    GROUP BY categories.id
+'''
+
+
+@event.listens_for(question_counts, 'after_create')
+def on_question_counts_create(target, connection, **kwargs):
+    connection.info['fill_question_counts'] = True
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def on_tables_create(target, connection, **kwargs):
+    # the counts and changes of an existing database are filled in once all tables exist
+    if connection.info.pop('fill_question_counts', False):
+        connection.execute('INSERT INTO question_counts (category_id, count) ' + count_questions_statement)
+    if connection.info.pop('fill_question_changes', False):
+        record_new_questions(connection)
+
+
+'''
+change_question_counts(connection, changes)
+    adds the {category: difference} changes to the question counts, within the transaction of connection
+'''
+
+
+def change_question_counts(connection, changes):
+    for category, difference in changes.items():
+        if category is None or difference == 0:
+            continue
+
+        result = connection.execute(
+            question_counts.update()
+            .where(question_counts.c.category_id == category)
+            .values(count=question_counts.c.count + difference)
+        )
+        if result.rowcount == 0:
+            # the category has no counter yet, count its questions including the changed ones
+            connection.execute(question_counts.insert().from_select(
+                ['category_id', 'count'],
+                db.select([db.literal(category), db.func.count(Question.id)]).where(Question.category == category)
+            ))
+
+
+'''
+get_question_count(category)
+    returns the number of questions within the given category, or of all questions
+'''
+
+
+def get_question_count(category=None):
+    query = db.session.query(db.func.coalesce(db.func.sum(QuestionCount.count), 0))
+    if category is not None:
+        query = query.filter(QuestionCount.category_id == category)
+    return query.scalar()
+
+
+'''
+reconcile_question_counts()
+    recounts the questions of every category, corrects the counters which drifted,
+    for example after questions were changed around the models, and returns them as
+    (category, stored count, actual count) tuples
+'''
+
+
+def reconcile_question_counts():
+    drifted = []
+
+    with db.engine.begin() as connection:
+        # block writes to the questions while they are counted
+        if connection.dialect.name == 'postgresql':
+            connection.execute('LOCK TABLE questions IN SHARE MODE')
+
+        stored_counts = dict(connection.execute(db.select([question_counts.c.category_id, question_counts.c.count])).fetchall())
+        for category, count in connection.execute(count_questions_statement).fetchall():
+            stored_count = stored_counts.pop(category, None)
+            if stored_count == count:
+                continue
+
+            drifted.append((category, stored_count, count))
+            if stored_count is None:
+                connection.execute(question_counts.insert().values(category_id=category, count=count))
+            else:
+                connection.execute(question_counts.update().where(question_counts.c.category_id == category).values(count=count))
+
+        # counters of categories which no longer exist
+        for category, stored_count in stored_counts.items():
+            drifted.append((category, stored_count, 0))
+            connection.execute(question_counts.delete().where(question_counts.c.category_id == category))
+
+    return drifted
+
+
+'''
+Pending question changes
+    the mapper events collect the count and version changes of the questions flushed by
+    a session, and they are written once at the end of the flush, so that a flush of many
+    questions runs one statement per category and two for the versions instead of a few
+    statements per question
+'''
+
+
+def add_pending_counts(connection, question, changes):
+    session = orm.object_session(question)
+    if session is None:
+        change_question_counts(connection, changes)
+        return
+
+    pending_counts = session.info.setdefault('pending_question_counts', {})
+    for category, difference in changes.items():
+        pending_counts[category] = pending_counts.get(category, 0) + difference
+
+
+@event.listens_for(orm.Session, 'after_flush')
+def on_flush(session, flush_context):
+    pending_counts = session.info.pop('pending_question_counts', None)
+    pending_changes = session.info.pop('pending_question_changes', None)
+
+    if pending_counts:
+        change_question_counts(session.connection(), pending_counts)
+    if pending_changes:
+        write_question_changes(session.connection(), pending_changes)
+
+
+@event.listens_for(orm.Session, 'after_rollback')
+def on_rollback(session):
+    session.info.pop('pending_question_counts', None)
+    session.info.pop('pending_question_changes', None)
+
+
+@event.listens_for(Question, 'after_insert')
+def on_question_insert(mapper, connection, question):
+    add_pending_counts(connection, question, {question.category: 1})
+
+
+@event.listens_for(Question, 'after_update')
+def on_question_update(mapper, connection, question):
+    history = orm.attributes.get_history(question, 'category')
+    if history.has_changes():
+        changes = {}
+        for category in history.deleted:
+            changes[category] = changes.get(category, 0) - 1
+        for category in history.added:
+            changes[category] = changes.get(category, 0) + 1
+        add_pending_counts(connection, question, changes)
+
+
+@event.listens_for(Question, 'after_delete')
+def on_question_delete(mapper, connection, question):
+    add_pending_counts(connection, question, {question.category: -1})
+
+
+@event.listens_for(Category, 'after_insert')
+def on_category_insert(mapper, connection, category):
+    connection.execute(question_counts.insert().values(category_id=category.id, count=0))
+
+
+'''
+QuestionChange
+    the latest change of every question, stamped with a version which increases with every
+    change, so that clients fetch only the questions changed since the last version they
+    have seen. A deleted question keeps its change as a tombstone. Every change of a question
+    replaces its previous one within the transaction of the change.
+'''
+
+
+class QuestionChange(db.Model):
+    __tablename__ = 'question_changes'
+    # without AUTOINCREMENT sqlite reuses the version of a replaced last change
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    version = Column(Integer, primary_key=True)
+    question_id = Column(Integer, nullable=False, unique=True)
+    deleted = Column(Boolean, nullable=False, default=False)
+
+
+question_changes = QuestionChange.__table__
+
+# the key of the PostgreSQL advisory lock serializing the changes
+QUESTION_CHANGES_LOCK = 0x7472697669610001
+
+
+@event.listens_for(question_changes, 'after_create')
+def on_question_changes_create(target, connection, **kwargs):
+    connection.info['fill_question_changes'] = True
+
+
+'''
+lock_question_changes(connection)
+    serializes the transactions recording changes on PostgreSQL, so that they commit in the
+    order of their versions and a client never skips a version committed after a later one
+'''
+
+
+def lock_question_changes(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(db.select([db.func.pg_advisory_xact_lock(QUESTION_CHANGES_LOCK)]))
+
+
+'''
+record_question_changes(connection, question_ids, deleted)
+    stamps the questions with the given ids as changed, or as deleted, within the transaction of connection
+'''
+
+
+def record_question_changes(connection, question_ids, deleted=False):
+    write_question_changes(connection, {question_id: deleted for question_id in question_ids})
+
+
+def write_question_changes(connection, changes):
+    # changes maps question ids to whether they were deleted, in the order of the changes
+    if len(changes) == 0:
+        return
+
+    lock_question_changes(connection)
+    connection.execute(question_changes.delete().where(question_changes.c.question_id.in_(list(changes))))
+    connection.execute(question_changes.insert(), [{'question_id': question_id, 'deleted': deleted} for question_id, deleted in changes.items()])
+
+
+'''
+record_new_questions(connection, after_id)
+    stamps the questions with ids above after_id which have no change yet as changed, in
+    the order of their ids, for questions inserted around the models
+'''
+
+
+def record_new_questions(connection, after_id=0):
+    lock_question_changes(connection)
+    connection.execute(question_changes.insert().from_select(
+        ['question_id', 'deleted'],
+        db.select([Question.id, db.false()])
+        .where(Question.id > after_id)
+        .where(~db.exists().where(question_changes.c.question_id == Question.id))
+        .order_by(Question.id)
+    ))
+
+
+def add_pending_change(connection, question, deleted):
+    session = orm.object_session(question)
+    if session is None:
+        record_question_changes(connection, [question.id], deleted)
+        return
+
+    # a question changed again within the flush moves to the end
+    pending_changes = session.info.setdefault('pending_question_changes', {})
+    pending_changes.pop(question.id, None)
+    pending_changes[question.id] = deleted
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_update')
+def on_question_change(mapper, connection, question):
+    add_pending_change(connection, question, False)
+
+
+@event.listens_for(Question, 'after_delete')
+def on_question_change_delete(mapper, connection, question):
+    add_pending_change(connection, question, True)
@@ -54,7 +54,7 @@ class QuizView extends Component {
                     previousQuestions: previousQuestions,
                     currentQuestion: result.question,
                     guess: '',
-                    forceEnd: typeof result.question !== 'object'
+                    forceEnd: !result.question
                 })
             })
             .catch(() => {